@@ -3,11 +3,9 @@ from examples import models
 
 adt_client = ADTClient()
 
-adt_client.upload_model(models.Person)
-adt_client.upload_model(models.Pet)
-adt_client.upload_model(models.Dog)
-adt_client.upload_model(models.Cat)
-adt_client.upload_model(models.Terrier)
+adt_client.sync_models(
+    [models.Person, models.Pet, models.Dog, models.Cat, models.Terrier]
+)
 
 
 for i in range(1, 11):
@@ -1,33 +1,346 @@
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from typing import TYPE_CHECKING
 from typing import Any
+from typing import Callable
 from typing import Generator
 from typing import Generic
+from typing import Hashable
+from typing import Iterable
+from typing import Iterator
+from typing import Mapping
+from typing import MutableMapping
+from typing import NamedTuple
+from typing import Optional
 from typing import Type
 from typing import TypeVar
 from typing import Union
 
-from azure.core.exceptions import ResourceExistsError
-from azure.core.paging import ItemPaged
-from azure.digitaltwins.core import DigitalTwinsClient
-from azure.digitaltwins.core import DigitalTwinsModelData
-from azure.identity import DefaultAzureCredential
+import pydantic
 
+from duality import dtdl
 from duality.models import BaseModel
 from duality.models import ModelMetaclass
+from duality.patch import apply_patch
 
 T = TypeVar("T", bound=BaseModel)
+K = TypeVar("K", bound=Hashable)
+R = TypeVar("R")
+
+# The Azure SDK is slow to import, so it is only imported once a service client is needed
+if TYPE_CHECKING:  # pragma: no cover
+    from azure.core.paging import ItemPaged
+    from azure.digitaltwins.core import DigitalTwinsClient
+    from azure.digitaltwins.core import DigitalTwinsModelData
+
+    from duality.frames import TwinFrame
+
+# The maximum number of values ADT accepts within a single `IN [...]` clause
+MAX_IN_CLAUSE_VALUES = 100
+
+
+def _chunked(values: Iterable[K], size: int) -> Iterator[list[K]]:
+    """Split an iterable into lists of at most `size` items."""
+    chunk: list[K] = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _run_parallel(
+    func: Callable[[K], R], items: Iterable[K], concurrency: int
+) -> tuple[dict[K, R], dict[K, Exception]]:
+    """Call `func` for each item using at most `concurrency` threads.
+
+    Returns a tuple of the results and the raised exceptions, each keyed by item.
+
+    """
+    results: dict[K, R] = {}
+    errors: dict[K, Exception] = {}
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = {executor.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                results[item] = future.result()
+            except Exception as e:
+                errors[item] = e
+    return results, errors
+
+
+def _topological_order(extends: Mapping[str, Iterable[str]]) -> list[str]:
+    """Order model ids such that every model comes after the models it extends.
+
+    Bases which are not themselves keys of the mapping are ignored.
+
+    """
+    ordered: list[str] = []
+    visited: set[str] = set()
+
+    def visit(model_id: str) -> None:
+        if model_id in visited:
+            return
+        visited.add(model_id)
+        for base_id in extends[model_id]:
+            if base_id in extends:
+                visit(base_id)
+        ordered.append(model_id)
+
+    for model_id in extends:
+        visit(model_id)
+    return ordered
+
+
+def _quote(value: str) -> str:
+    """Quote a string literal for use within an ADT query."""
+    escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def _replace_ids(value: Any, ids: Mapping[str, str]) -> Any:
+    """Replace the model ids within a DTDL document, e.g. the target of a relationship."""
+    if isinstance(value, dict):
+        return {key: _replace_ids(item, ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_replace_ids(item, ids) for item in value]
+    if isinstance(value, str):
+        return ids.get(value, value)
+    return value
+
+
+def _normalize_interface(data: Mapping[str, Any]) -> Optional[dict[str, Any]]:
+    """Return a DTDL interface in a canonical form for comparison, or `None` if it uses
+    features which cannot be represented by a `dtdl.Interface`.
+
+    """
+    try:
+        interface = dtdl.Interface(**data).dict()
+    except pydantic.ValidationError:
+        return None
+    interface["contents"] = sorted(
+        interface.get("contents") or [], key=lambda c: (c["@type"], c["name"])
+    )
+    return interface
+
+
+class ModelDiff(pydantic.BaseModel):
+    """The difference between local model classes and the models deployed to ADT.
+
+    Each local model is compared with the latest deployed version of its path. Models
+    are new if no version at least as recent as theirs is deployed. They are changed if
+    the latest version has a different definition or is decommissioned, or if a later
+    version is required, e.g. by another shard, in which case they are listed by the id
+    of the version to deploy. Stale models are deployed, not decommissioned, and have
+    the same path as a local model, but a different version.
+
+    """
+
+    new: list[str] = []
+    changed: list[str] = []
+    unchanged: list[str] = []
+    stale: list[str] = []
+    ids: dict[str, str] = {}
+
+
+class PurgeSummary(pydantic.BaseModel):
+    """A summary of the objects deleted by `ADTClient.purge`."""
+
+    relationships_deleted: int = 0
+    twins_deleted: int = 0
+    models_deleted: list[str] = []
+    failed: dict[str, str] = {}
+
+
+class TwinLookup(NamedTuple):
+    """The twins found by `ADTClient.get_many`, keyed by id, and the ids not found."""
+
+    found: dict[str, BaseModel]
+    missing: list[str]
+
+
+class FlushResult(pydantic.BaseModel):
+    """The twins written in bulk, and the errors of any failures."""
+
+    written: list[str] = []
+    failed: dict[str, str] = {}
+
+
+class PrefetchingIterator(Generic[T]):
+    """Iterate over query results, while fetching the following pages in a background thread.
+
+    At most `max_pages` pages are buffered, and optionally at most `max_rows` rows or
+    `max_bytes` bytes, such that network latency overlaps with hydration without
+    unbounded memory growth. A single page is always buffered, even if it exceeds a limit.
+    The size of each page is given by `page_bytes`, which is called once the page has
+    been fetched, and without which `max_bytes` is not enforced.
+
+    The buffer size and the time spent waiting, both by the fetching thread on a full
+    buffer and by the consumer on an empty buffer, are exposed as attributes.
+
+    """
+
+    def __init__(
+        self,
+        pages: Iterator[Iterator[dict[str, object]]],
+        max_pages: int = 2,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        page_bytes: Optional[Callable[[], int]] = None,
+    ):
+        self.max_pages = max_pages
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+        self.buffered_pages = 0
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+        self.fetch_wait_time = 0.0
+        self.consume_wait_time = 0.0
+
+        self._buffer: deque[tuple[list[dict[str, object]], int]] = deque()
+        self._current: Iterator[dict[str, object]] = iter(())
+        self._condition = threading.Condition()
+        self._done = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+        self._thread = threading.Thread(
+            target=self._fetch, args=(pages, page_bytes), daemon=True
+        )
+        self._thread.start()
+
+    def _has_capacity(self, rows: int, size: int) -> bool:
+        if self._closed or not self._buffer:
+            return True
+        return (
+            self.buffered_pages < self.max_pages
+            and (self.max_rows is None or self.buffered_rows + rows <= self.max_rows)
+            and (self.max_bytes is None or self.buffered_bytes + size <= self.max_bytes)
+        )
+
+    def _fetch(
+        self,
+        pages: Iterator[Iterator[dict[str, object]]],
+        page_bytes: Optional[Callable[[], int]],
+    ) -> None:
+        try:
+            for page in pages:
+                rows = list(page)
+                size = page_bytes() if page_bytes is not None else 0
+                with self._condition:
+                    start = time.perf_counter()
+                    self._condition.wait_for(
+                        lambda: self._has_capacity(len(rows), size)
+                    )
+                    self.fetch_wait_time += time.perf_counter() - start
+                    if self._closed:
+                        return
+                    self._buffer.append((rows, size))
+                    self.buffered_pages += 1
+                    self.buffered_rows += len(rows)
+                    self.buffered_bytes += size
+                    self._condition.notify_all()
+        except BaseException as e:
+            self._error = e
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def _next_page(self) -> Iterator[dict[str, object]]:
+        with self._condition:
+            start = time.perf_counter()
+            self._condition.wait_for(lambda: self._buffer or self._done)
+            self.consume_wait_time += time.perf_counter() - start
+            if not self._buffer:
+                if self._error is not None:
+                    raise self._error
+                raise StopIteration
+            rows, size = self._buffer.popleft()
+            self.buffered_pages -= 1
+            self.buffered_rows -= len(rows)
+            self.buffered_bytes -= size
+            self._condition.notify_all()
+        return iter(rows)
+
+    def __iter__(self) -> "PrefetchingIterator[T]":
+        return self
+
+    def __next__(self) -> T:
+        while True:
+            for data in self._current:
+                return BaseModel.from_twin_dtdl(**data)  # type: ignore
+            self._current = self._next_page()
+
+    def close(self) -> None:
+        """Stop fetching pages, and release the buffer."""
+        with self._condition:
+            self._closed = True
+            self._buffer.clear()
+            self.buffered_pages = self.buffered_rows = self.buffered_bytes = 0
+            self._condition.notify_all()
+
+    def __enter__(self) -> "PrefetchingIterator[T]":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised when the query charge of a query exceeds its budget."""
+
+
+class QueryStats(pydantic.BaseModel):
+    """The cost of executing one or more queries.
+
+    The charge is reported by ADT in query units, via the "query-charge" header of each
+    page of results.
+
+    """
+
+    queries: int = 0
+    pages: int = 0
+    rows: int = 0
+    bytes: int = 0
+    charge: float = 0.0
+
+
+# Guards updates to statistics, which may be shared by queries executing in parallel
+_stats_lock = threading.Lock()
 
 
 class ADTQuery(Generic[T]):
-    def __init__(self, client: DigitalTwinsClient):
+    def __init__(
+        self,
+        client: "DigitalTwinsClient",
+        collection: str = "digitaltwins",
+        client_stats: Optional[QueryStats] = None,
+        budget: Optional[float] = None,
+    ):
         self._client = client
+        self._collection = collection
         self._selector = "*"
         self._wheres: list[str] = []
+        self._budget = budget
+        self._client_stats = client_stats
+        self._last_page_bytes = 0
+        self.stats = QueryStats()
 
-    def _execute(self) -> ItemPaged[dict[str, object]]:
+    @property
+    def query_string(self) -> str:
+        """The compiled query string."""
         clauses = [
             f"SELECT {self._selector}",
-            "FROM digitaltwins",
+            f"FROM {self._collection}",
         ]
         if self._wheres:
             clauses.append("WHERE")
@@ -35,9 +348,37 @@ class ADTQuery(Generic[T]):
                 clauses.append(where)
                 clauses.append("AND")
             clauses.pop(-1)
+        return " ".join(clauses)
+
+    def _record_page(
+        self, pipeline_response: Any, deserialized: Any, headers: dict[str, Any]
+    ) -> Any:
+        """Record the cost of a page of results, and enforce the budget."""
+        try:
+            size = len(pipeline_response.http_response.body())
+        except Exception:
+            size = 0
+        charge = float(headers.get("query-charge") or 0.0)
+        self._last_page_bytes = size
+        for stats in filter(None, [self.stats, self._client_stats]):
+            with _stats_lock:
+                stats.pages += 1
+                stats.rows += len(deserialized.value or [])
+                stats.bytes += size
+                stats.charge += charge
 
-        query_string = " ".join(clauses)
-        return self._client.query_twins(query_string)
+        if self._budget is not None and self.stats.charge > self._budget:
+            raise QueryBudgetExceeded(
+                f"Query charge of {self.stats.charge} exceeds the budget of "
+                f"{self._budget}: {self.query_string}"
+            )
+        return deserialized
+
+    def _execute(self) -> "ItemPaged[dict[str, object]]":
+        for stats in filter(None, [self.stats, self._client_stats]):
+            with _stats_lock:
+                stats.queries += 1
+        return self._client.query_twins(self.query_string, cls=self._record_page)
 
     def of_model(self, model_class: Type[T], exact: bool = False) -> "ADTQuery":
         """Filter results to return instances of a single model type."""
@@ -48,6 +389,45 @@ class ADTQuery(Generic[T]):
         self._wheres.append(clause)
         return self
 
+    def where_in(self, field: str, values: Iterable[str]) -> "ADTQuery":
+        """Filter results to those whose `field` is one of the `values`.
+
+        ADT limits the length of the list, see `MAX_IN_CLAUSE_VALUES`.
+
+        """
+        literals = ", ".join(_quote(v) for v in values)
+        self._wheres.append(f"{field} IN [{literals}]")
+        return self
+
+    def budget(self, max_charge: float) -> "ADTQuery":
+        """Abort the query with `QueryBudgetExceeded` once its total charge exceeds
+        `max_charge` query units.
+
+        """
+        self._budget = max_charge
+        return self
+
+    def explain(self, execute: bool = False) -> str:
+        """Describe the compiled query, and the cost of its executions so far.
+
+        If `execute` is True, the query is first executed, without hydrating the results.
+
+        """
+        if execute:
+            for _ in self._execute():
+                pass
+        stats = self.stats
+        return "\n".join(
+            [
+                f"Query:   {self.query_string}",
+                f"Runs:    {stats.queries}",
+                f"Pages:   {stats.pages}",
+                f"Rows:    {stats.rows}",
+                f"Bytes:   {stats.bytes}",
+                f"Charge:  {stats.charge:g}",
+            ]
+        )
+
     def count(self) -> int:
         """Return the number of objects returned by the query."""
         self._selector = "COUNT()"
@@ -62,14 +442,74 @@ class ADTQuery(Generic[T]):
         for data in self._execute():
             yield BaseModel.from_twin_dtdl(**data)  # type:ignore
 
+    def prefetch(
+        self,
+        max_pages: int = 2,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> PrefetchingIterator[T]:
+        """Return an iterator of all objects returned by the query, which fetches pages
+        in a background thread while the current page is being hydrated.
+
+        The iterator must be closed if it is not exhausted, otherwise the background
+        thread remains blocked on a full buffer. As such, use it as a context manager::
+
+            with client.query.of_model(Model).prefetch() as results:
+                for twin in results:
+                    ...
+
+        """
+        return PrefetchingIterator(
+            self._execute().by_page(),
+            max_pages,
+            max_rows,
+            max_bytes,
+            page_bytes=lambda: self._last_page_bytes,
+        )
+
+    def rows(self) -> Generator[dict[str, object], None, None]:
+        """Return a generator of the rows returned by the query, without hydrating them,
+        e.g. the relationships returned by a relationship query.
+
+        """
+        yield from self._execute()
+
+    def ids(self) -> Generator[str, None, None]:
+        """Return a generator of the `$dtId` of all twins returned by the query."""
+        self._selector = "$dtId"
+        for data in self._execute():
+            yield str(data["$dtId"])
+
 
 class ADTClient:
     """An Azure Digital Twins client wrapper to interface between duality models and ADT."""
 
-    _service_client: DigitalTwinsClient
+    _service_client: "DigitalTwinsClient"
+
+    def __init__(
+        self,
+        service_client: Optional["DigitalTwinsClient"] = None,
+        query_budget: Optional[float] = None,
+        cache: Optional[MutableMapping[str, BaseModel]] = None,
+    ):
+        """Construct a client.
+
+        Args:
+            service_client: The Azure SDK client, otherwise constructed on first use.
+            query_budget: The maximum charge, in query units, of each query.
+            cache: A mapping, e.g. a dictionary or LRU cache, in which twins fetched by
+                `get` and `get_many` are cached by id. Writes through this client
+                invalidate the cached twins.
+
+        """
+        if service_client is not None:
+            self._service_client = service_client
+        self.query_budget = query_budget
+        self.query_stats = QueryStats()
+        self.cache = cache
 
     @property
-    def service_client(self) -> DigitalTwinsClient:
+    def service_client(self) -> "DigitalTwinsClient":
         """Construct an Azure Digital Twins client.
 
         Reads credentials from the following environment variables, which can be placed in a `.env` file:
@@ -81,6 +521,11 @@ class ADTClient:
 
         """
         if getattr(self, "_service_client", None) is None:
+            from azure.digitaltwins.core import DigitalTwinsClient
+            from azure.identity import DefaultAzureCredential
+            from dotenv import load_dotenv
+
+            load_dotenv()
             url = os.getenv("AZURE_URL", "")
             credential = DefaultAzureCredential()
             self._service_client = DigitalTwinsClient(url, credential)
@@ -89,11 +534,22 @@ class ADTClient:
 
     @property
     def query(self) -> ADTQuery:
-        return ADTQuery(self.service_client)
+        return ADTQuery(
+            self.service_client, "digitaltwins", self.query_stats, self.query_budget
+        )
+
+    @property
+    def relationship_query(self) -> ADTQuery:
+        """A query of relationships, rather than twins."""
+        return ADTQuery(
+            self.service_client, "relationships", self.query_stats, self.query_budget
+        )
 
     def upload_model(
         self, model: Type[BaseModel], exist_ok: bool = True
-    ) -> DigitalTwinsModelData:
+    ) -> "DigitalTwinsModelData":
+        from azure.core.exceptions import ResourceExistsError
+
         sc = self.service_client
         try:
             adt_model = sc.create_models([model.to_interface().dict()])
@@ -107,7 +563,74 @@ class ADTClient:
     def delete_model(self, model: Union[Type[BaseModel], ModelMetaclass]) -> None:
         self.service_client.delete_model(model.id)
 
+    def _forget(self, twin_ids: Iterable[str]) -> None:
+        """Remove twins from the cache."""
+        if self.cache is not None:
+            for twin_id in twin_ids:
+                self.cache.pop(twin_id, None)
+
+    def get(self, model: Type[T], twin_id: str) -> T:
+        """Fetch a single twin by id, in a single round trip.
+
+        Raises `azure.core.exceptions.ResourceNotFoundError` if the twin does not exist,
+        and `TypeError` if it is not an instance of `model`.
+
+        """
+        twin = self.cache.get(twin_id) if self.cache is not None else None
+        if twin is None:
+            twin = BaseModel.from_twin_dtdl(
+                **self.service_client.get_digital_twin(twin_id)
+            )
+            if self.cache is not None:
+                self.cache[twin_id] = twin
+        if not isinstance(twin, model):
+            raise TypeError(f"Twin {twin_id} is not an instance of {model.__name__}")
+        return twin
+
+    def get_many(
+        self,
+        twin_ids: Iterable[str],
+        model: Optional[Type[BaseModel]] = None,
+        concurrency: int = 8,
+    ) -> TwinLookup:
+        """Fetch many twins by id, using `$dtId IN [...]` queries run in parallel.
+
+        If `model` is given, twins which are not instances of it are reported as missing.
+
+        """
+        twin_ids = list(dict.fromkeys(twin_ids))
+        cached = {}
+        if self.cache is not None:
+            cached = {i: self.cache[i] for i in twin_ids if i in self.cache}
+
+        chunks = list(
+            _chunked([i for i in twin_ids if i not in cached], MAX_IN_CLAUSE_VALUES)
+        )
+
+        def fetch(index: int) -> list[BaseModel]:
+            query = self.query.where_in("$dtId", chunks[index])
+            if model is not None:
+                query.of_model(model)
+            return list(query.all())
+
+        results, errors = _run_parallel(fetch, range(len(chunks)), concurrency)
+        for e in errors.values():
+            raise e
+
+        fetched = {twin.id: twin for twins in results.values() for twin in twins}
+        if self.cache is not None:
+            self.cache.update(fetched)
+
+        found = {}
+        for twin_id in twin_ids:
+            twin = cached.get(twin_id, fetched.get(twin_id))
+            if twin is not None and (model is None or isinstance(twin, model)):
+                found[twin_id] = twin
+        return TwinLookup(found, [i for i in twin_ids if i not in found])
+
     def upload_twin(self, instance: BaseModel) -> BaseModel:
+        self._forget([instance.id])
+
         def create_instance(_: Any, data: Any, __: Any) -> BaseModel:
             return instance.__class__(**data)
 
@@ -115,5 +638,439 @@ class ADTClient:
             instance.id, instance.to_twin_dtdl(), cls=create_instance
         )
 
+    def update_twin(self, twin_id: str, patch: list[dict[str, Any]]) -> None:
+        """Update a twin with a JSON patch."""
+        self._forget([twin_id])
+        self.service_client.update_digital_twin(twin_id, patch)
+
+    def upload_frame(self, frame: "TwinFrame", concurrency: int = 8) -> FlushResult:
+        """Upload the valid rows of a `TwinFrame`, using parallel requests."""
+        documents = {document["$dtId"]: document for document in frame.to_twin_dtdl()}
+        self._forget(documents)
+        written, errors = _run_parallel(
+            lambda twin_id: self.service_client.upsert_digital_twin(
+                twin_id, documents[twin_id]
+            ),
+            documents,
+            concurrency,
+        )
+        return FlushResult(
+            written=list(written),
+            failed={twin_id: str(e) for twin_id, e in errors.items()},
+        )
+
     def delete_twin(self, instance: BaseModel) -> None:
+        self._forget([instance.id])
         self.service_client.delete_digital_twin(instance.id)
+
+    def write_behind(
+        self, max_pending: int = 1000, max_age: float = 1.0, concurrency: int = 8
+    ) -> "WriteBehindBuffer":
+        """Return a buffer which coalesces twin writes, and sends them in batches."""
+        return WriteBehindBuffer(self, max_pending, max_age, concurrency)
+
+    def find_relationships(
+        self,
+        twin_ids: Iterable[str],
+        fields: Iterable[str] = ("$sourceId", "$targetId"),
+        names: Optional[Iterable[str]] = None,
+        concurrency: int = 8,
+    ) -> list[dict[str, object]]:
+        """Find the relationships whose `fields` are any of the twins, using batched
+        queries run in parallel.
+
+        Defaults to both outgoing and incoming relationships, optionally only those with
+        one of the relationship `names`. Relationships are returned in the order of the
+        queries, once for each of the `fields` by which they are found.
+
+        """
+        wheres = [] if names is None else [("$relationshipName", list(names))]
+        queries = [
+            [(field, chunk), *wheres]
+            for chunk in _chunked(twin_ids, MAX_IN_CLAUSE_VALUES)
+            for field in fields
+        ]
+
+        def fetch(index: int) -> list[dict[str, object]]:
+            query = self.relationship_query
+            for field, values in queries[index]:
+                query.where_in(field, values)
+            return list(query.rows())
+
+        results, errors = _run_parallel(fetch, range(len(queries)), concurrency)
+        for e in errors.values():
+            raise e
+        return [data for index in range(len(queries)) for data in results[index]]
+
+    def _relationships(
+        self, twin_ids: Iterable[str], concurrency: int = 8
+    ) -> dict[tuple[str, str], str]:
+        """Find all incoming and outgoing relationships of the twins.
+
+        Returns a mapping of (`$sourceId`, `$relationshipId`) to `$targetId`.
+
+        """
+        relationships: dict[tuple[str, str], str] = {}
+        for data in self.find_relationships(twin_ids, concurrency=concurrency):
+            key = (str(data["$sourceId"]), str(data["$relationshipId"]))
+            relationships[key] = str(data["$targetId"])
+        return relationships
+
+    def _deployed_models(self) -> dict[str, "DigitalTwinsModelData"]:
+        """Fetch all deployed models, including their definitions, keyed by id."""
+        return {
+            model_data.id: model_data
+            for model_data in self.service_client.list_models(
+                include_model_definition=True
+            )
+        }
+
+    def _deployed_model_bases(self) -> dict[str, list[str]]:
+        """Map the id of each deployed model to the ids of the models it extends."""
+        bases: dict[str, list[str]] = {}
+        for model_id, model_data in self._deployed_models().items():
+            extends = (model_data.model or {}).get("extends") or []
+            if isinstance(extends, str):
+                extends = [extends]
+            bases[model_id] = list(extends)
+        return bases
+
+    @staticmethod
+    def _local_models(
+        models: Optional[Iterable[Union[Type[BaseModel], ModelMetaclass]]],
+    ) -> list[Type[BaseModel]]:
+        """The given models, or all registered models, in dependency order."""
+        if models is None:
+            models = BaseModel._class_registry.values()
+        # Model classes are typed as their metaclass when listed together
+        by_id: dict[str, Type[BaseModel]] = {
+            model.id: model for model in models  # type: ignore
+        }
+        order = _topological_order(
+            {model_id: _model_dependencies(m) for model_id, m in by_id.items()}
+        )
+        return [by_id[model_id] for model_id in order]
+
+    def _plan_models(
+        self,
+        models: list[Type[BaseModel]],
+        deployed: Optional[Mapping[str, "DigitalTwinsModelData"]] = None,
+        versions: Optional[Mapping[str, int]] = None,
+    ) -> tuple[ModelDiff, list[MutableMapping[str, Any]]]:
+        """Compare local models with the deployed models, returning the diff along with
+        the interfaces to upload.
+
+        Each model is compared with the latest deployed version of its path, with its
+        references resolved to the versions of the models it depends upon. As such, the
+        result only depends on the model classes and the deployed models. A model whose
+        latest version is decommissioned is changed, since no twins can be created with it.
+
+        The `versions` are the minimum versions to deploy, keyed by model path, e.g. such
+        that several instances deploy the same version of each model.
+
+        """
+        if deployed is None:
+            deployed = self._deployed_models()
+        latest: dict[str, int] = {}
+        for model_id in deployed:
+            _, path, version = dtdl.DTMI.parts_from_string(model_id)
+            latest[path] = max(latest.get(path, 0), int(version))
+
+        diff = ModelDiff()
+        uploads: list[MutableMapping[str, Any]] = []
+        for model in models:
+            _, path, version = dtdl.DTMI.parts_from_string(model.id)
+            min_version = max(int(version), (versions or {}).get(path, 0))
+            interface = _replace_ids(model.to_dict(), diff.ids)
+            if path not in latest or int(version) > latest[path]:
+                status, model_id = "new", dtdl.DTMI(path=path, version=min_version)
+            elif min_version > latest[path]:
+                status, model_id = "changed", dtdl.DTMI(path=path, version=min_version)
+            else:
+                model_id = dtdl.DTMI(path=path, version=latest[path])
+                remote = _normalize_interface(deployed[model_id].model or {})
+                # Twins cannot be created with decommissioned models
+                if (
+                    getattr(deployed[model_id], "decommissioned", False)
+                    or remote is None
+                    or remote != _normalize_interface({**interface, "@id": model_id})
+                ):
+                    status = "changed"
+                    model_id = dtdl.DTMI(path=path, version=latest[path] + 1)
+                else:
+                    status = "unchanged"
+
+            diff.ids[model.id] = model_id
+            getattr(diff, status).append(model_id)
+            if status != "unchanged":
+                uploads.append({**interface, "@id": model_id})
+
+        current = set(diff.ids.values())
+        paths = {dtdl.DTMI.parts_from_string(model_id)[1] for model_id in current}
+        diff.stale = [
+            model_id
+            for model_id, model_data in deployed.items()
+            if model_id not in current
+            and not getattr(model_data, "decommissioned", False)
+            and dtdl.DTMI.parts_from_string(model_id)[1] in paths
+        ]
+        return diff, uploads
+
+    def diff_models(
+        self, models: Optional[Iterable[Union[Type[BaseModel], ModelMetaclass]]] = None
+    ) -> ModelDiff:
+        """Compare local model classes with the deployed models.
+
+        Defaults to all registered models. Deployed models are fetched in a single
+        paginated call.
+
+        """
+        diff, _ = self._plan_models(self._local_models(models))
+        return diff
+
+    def sync_models(
+        self,
+        models: Optional[Iterable[Union[Type[BaseModel], ModelMetaclass]]] = None,
+        decommission: bool = True,
+    ) -> ModelDiff:
+        """Upload only the new and changed models, and decommission stale ones.
+
+        Since deployed models are immutable, changed models are uploaded as the version
+        following the latest deployed version of their path, and models which extend,
+        or relate to, them are uploaded with the updated references. Running again with
+        the same model classes is a no-op, in this or any other process.
+
+        Each model class is then pinned to its deployed version, such that its twins
+        reference it. Returns the diff that was applied, whose `ids` map the original id
+        of each model class to its deployed id.
+
+        """
+        models = self._local_models(models)
+        diff, uploads = self._plan_models(models)
+        self._apply_plan(diff, uploads, decommission)
+        self._pin_models(models, diff)
+        return diff
+
+    def _apply_plan(
+        self,
+        diff: ModelDiff,
+        uploads: list[MutableMapping[str, Any]],
+        decommission: bool,
+    ) -> None:
+        """Upload the planned models, and decommission the stale ones."""
+        if uploads:
+            self.service_client.create_models(uploads)
+
+        if decommission:
+            for model_id in diff.stale:
+                self.service_client.decommission_model(model_id)
+
+    @staticmethod
+    def _pin_models(models: Iterable[Type[BaseModel]], diff: ModelDiff) -> None:
+        """Set the version of each model class to that of its deployed id."""
+        for model in models:
+            deployed_id = diff.ids[model.id]
+            if model.id != deployed_id:
+                model.model_version = int(dtdl.DTMI.parts_from_string(deployed_id)[2])
+                BaseModel._class_registry.add(model)
+
+    def purge(
+        self,
+        target: Union[ADTQuery, Type[BaseModel], None] = None,
+        concurrency: int = 8,
+        delete_models: bool = True,
+    ) -> PurgeSummary:
+        """Delete twins, their relationships, and optionally their models.
+
+        The `target` may either be a query, in which case all twins it returns are deleted,
+        or a model class, in which case all twins of that model (or its subclasses) are
+        deleted, along with the models themselves. When no target is given, everything
+        in the instance is deleted, including all models.
+
+        Relationships are found and deleted first, followed by the twins, each using at
+        most `concurrency` parallel requests. Models are deleted last, in reverse topological
+        order of their `extends` hierarchy.
+
+        """
+        if target is None:
+            query: ADTQuery = self.query
+        elif isinstance(target, ADTQuery):
+            query = target
+        else:
+            query = self.query.of_model(target)
+
+        summary = PurgeSummary()
+        twin_ids = list(query.ids())
+
+        relationships = self._relationships(twin_ids, concurrency)
+        _, relationship_errors = _run_parallel(
+            lambda key: self.service_client.delete_relationship(*key),
+            relationships,
+            concurrency,
+        )
+        summary.relationships_deleted = len(relationships) - len(relationship_errors)
+        for (source_id, relationship_id), e in relationship_errors.items():
+            summary.failed[f"{source_id}/{relationship_id}"] = str(e)
+
+        self._forget(twin_ids)
+        _, twin_errors = _run_parallel(
+            self.service_client.delete_digital_twin, twin_ids, concurrency
+        )
+        summary.twins_deleted = len(twin_ids) - len(twin_errors)
+        for twin_id, e in twin_errors.items():
+            summary.failed[twin_id] = str(e)
+
+        if not delete_models or isinstance(target, ADTQuery):
+            return summary
+
+        if target is None:
+            bases = self._deployed_model_bases()
+        else:
+            bases = {
+                class_.id: list(filter(None, [class_.to_interface().extends]))
+                for class_ in set(BaseModel._class_registry.values())
+                if issubclass(class_, target)
+            }
+
+        for model_id in reversed(_topological_order(bases)):
+            try:
+                self.service_client.delete_model(model_id)
+            except Exception as e:
+                summary.failed[model_id] = str(e)
+            else:
+                summary.models_deleted.append(model_id)
+
+        return summary
+
+
+class WriteBehindBuffer:
+    """Collect twin writes, coalescing those to the same `$dtId`, and send them later.
+
+    Uploads of a twin replace any pending write to it, whereas patches are either applied
+    to a pending upload, or combined with other pending patches, keeping the last operation
+    on each path. Since a path may not have existed before a pending "add", a following
+    "replace" is sent as an "add", and a following "remove" is sent along with the "add". Pending writes are flushed when `max_pending` twins have writes, once the
+    oldest write is `max_age` seconds old, or when `flush` is called explicitly, using at
+    most `concurrency` parallel requests.
+
+    Errors from flushes which are not called explicitly are collected in `failed`.
+
+    """
+
+    def __init__(
+        self,
+        client: ADTClient,
+        max_pending: int = 1000,
+        max_age: float = 1.0,
+        concurrency: int = 8,
+    ):
+        self.client = client
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.failed: dict[str, str] = {}
+
+        self._documents: dict[str, dict[str, Any]] = {}
+        self._patches: dict[str, dict[str, list[dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._documents) + len(self._patches)
+
+    def _added(self) -> bool:
+        """Start the age timer, and return whether the buffer is full. Called while locked."""
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_age, self._auto_flush)
+            self._timer.daemon = True
+            self._timer.start()
+        return len(self._documents) + len(self._patches) >= self.max_pending
+
+    def upload_twin(self, instance: BaseModel) -> None:
+        """Queue an upsert of the full twin, replacing any pending write to it."""
+        with self._lock:
+            self._patches.pop(instance.id, None)
+            self._documents[instance.id] = instance.to_twin_dtdl()
+            full = self._added()
+        if full:
+            self._auto_flush()
+
+    def update_twin(self, twin_id: str, patch: list[dict[str, Any]]) -> None:
+        """Queue a JSON patch of a twin, combining it with any pending write to it."""
+        with self._lock:
+            if twin_id in self._documents:
+                apply_patch(self._documents[twin_id], patch)
+            else:
+                pending = self._patches.setdefault(twin_id, {})
+                for op in patch:
+                    # Re-insert, such that operations remain in the order last applied
+                    previous = pending.pop(op["path"], [])
+                    if previous and previous[0]["op"] == "add" and op["op"] == "remove":
+                        pending[op["path"]] = [previous[0], op]
+                    elif (
+                        previous
+                        and previous[0]["op"] == "add"
+                        and op["op"] == "replace"
+                    ):
+                        pending[op["path"]] = [{**op, "op": "add"}]
+                    else:
+                        pending[op["path"]] = [op]
+            full = self._added()
+        if full:
+            self._auto_flush()
+
+    def _write(
+        self,
+        twin_id: str,
+        documents: dict[str, dict[str, Any]],
+        patches: dict[str, dict[str, list[dict[str, Any]]]],
+    ) -> None:
+        if twin_id in documents:
+            self.client._forget([twin_id])
+            self.client.service_client.upsert_digital_twin(twin_id, documents[twin_id])
+        else:
+            self.client.update_twin(
+                twin_id, [op for ops in patches[twin_id].values() for op in ops]
+            )
+
+    def flush(self) -> FlushResult:
+        """Send all pending writes, returning the result of each."""
+        with self._flush_lock:
+            with self._lock:
+                documents, self._documents = self._documents, {}
+                patches, self._patches = self._patches, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            written, errors = _run_parallel(
+                lambda twin_id: self._write(twin_id, documents, patches),
+                [*documents, *patches],
+                self.concurrency,
+            )
+        return FlushResult(
+            written=list(written),
+            failed={twin_id: str(e) for twin_id, e in errors.items()},
+        )
+
+    def _auto_flush(self) -> None:
+        result = self.flush()
+        self.failed.update(result.failed)
+
+    def __enter__(self) -> "WriteBehindBuffer":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.flush()
+
+
+def _model_dependencies(model: Type[BaseModel]) -> list[str]:
+    """The ids of the models which a model extends or has relationships to."""
+    interface = model.to_interface()
+    dependencies: list[str] = [interface.extends] if interface.extends else []
+    for item in interface.contents or []:
+        if isinstance(item, dtdl.Relationship) and item.target:
+            dependencies.append(item.target)
+    return dependencies
@@ -0,0 +1,270 @@
+"""Consume streams of twin change events, as an alternative to polling queries.
+
+ADT publishes twin lifecycle events through event routes, typically to an Event Hub or
+Service Bus queue. An `EventSource` abstracts over the transport, and a
+`TwinChangeConsumer` hydrates the events into models and applies them to a local store.
+
+"""
+import json
+import os
+import queue
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import MutableMapping
+from typing import NamedTuple
+from typing import Optional
+from typing import Union
+
+import pydantic
+
+from duality.models import BaseModel
+from duality.patch import apply_patch
+
+# A position within an event source, which can be committed as a checkpoint
+Position = Any
+
+
+class TwinChangeEvent(pydantic.BaseModel):
+    """A single create, update, or delete of a twin."""
+
+    type: str
+    twin_id: str
+    model_id: Optional[str] = None
+    data: dict[str, Any] = {}
+    patch: list[dict[str, Any]] = []
+
+    @classmethod
+    def parse_event(cls, event: dict[str, Any]) -> "TwinChangeEvent":
+        """Parse either an ADT CloudEvent, or a dictionary of this model's fields.
+
+        ADT events have a type of "Microsoft.DigitalTwins.Twin.{Create,Update,Delete}"
+        and use the twin id as the subject. Update events contain a JSON patch, whereas
+        create and delete events contain the full twin.
+
+        """
+        if not str(event.get("type", "")).startswith("Microsoft.DigitalTwins.Twin."):
+            return cls.parse_obj(event)
+
+        type_ = event["type"].rpartition(".")[2].lower()
+        data = event.get("data") or {}
+        if type_ == "update":
+            return cls(
+                type=type_,
+                twin_id=event["subject"],
+                model_id=data.get("modelId"),
+                patch=data.get("patch", []),
+            )
+        return cls(
+            type=type_,
+            twin_id=event["subject"],
+            model_id=data.get("$metadata", {}).get("$model"),
+            data=data,
+        )
+
+
+class TwinChange(NamedTuple):
+    """A change event, along with the hydrated state of the twin after the change.
+
+    The twin is `None` for deletions, and for updates to twins which are not in the store,
+    in which case only the patch is known.
+
+    """
+
+    event: TwinChangeEvent
+    twin: Optional[BaseModel]
+
+
+class EventSource(ABC):
+    """The interface of a source of change events."""
+
+    @abstractmethod
+    def read(
+        self, max_events: int, timeout: float
+    ) -> list[tuple[Position, dict[str, Any]]]:
+        """Return up to `max_events` raw events, along with the position of each.
+
+        Waits at most `timeout` seconds for the first event to arrive.
+
+        """
+
+    @abstractmethod
+    def commit(self, position: Position) -> None:
+        """Record that all events up to, and including, `position` have been processed."""
+
+
+class FileEventSource(EventSource):
+    """Read events from a file containing one JSON document per line.
+
+    The position of each event is the byte offset following it. Reading always starts
+    after the last committed offset, so uncommitted events are redelivered. Committed
+    offsets are written to `checkpoint_path`, if given, such that a new process resumes
+    from there. While no events are available, the file is polled every `poll_interval`
+    seconds.
+
+    """
+
+    poll_interval = 0.1
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        checkpoint_path: Union[str, os.PathLike, None] = None,
+    ):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self._offset = 0
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as fp:
+                self._offset = int(fp.read() or 0)
+
+    def read(
+        self, max_events: int, timeout: float = 0.0
+    ) -> list[tuple[Position, dict[str, Any]]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self._read_available(max_events)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _read_available(self, max_events: int) -> list[tuple[Position, dict[str, Any]]]:
+        events: list[tuple[Position, dict[str, Any]]] = []
+        with open(self.path, "rb") as fp:
+            fp.seek(self._offset)
+            while len(events) < max_events:
+                line = fp.readline()
+                # Leave partially written lines to be read once complete
+                if not line.endswith(b"\n"):
+                    break
+                if line.strip():
+                    events.append((fp.tell(), json.loads(line)))
+        return events
+
+    def commit(self, position: Position) -> None:
+        self._offset = position
+        if self.checkpoint_path is not None:
+            with open(self.checkpoint_path, "w") as fp:
+                fp.write(str(position))
+
+
+class QueueEventSource(EventSource):
+    """Read events from an in-process `queue.Queue`.
+
+    Committing marks the events as done, but uncommitted events are not redelivered.
+
+    """
+
+    def __init__(self, event_queue: "queue.Queue[dict[str, Any]]"):
+        self.queue = event_queue
+        self._read = 0
+        self._committed = 0
+
+    def read(
+        self, max_events: int, timeout: float = 0.0
+    ) -> list[tuple[Position, dict[str, Any]]]:
+        events: list[dict[str, Any]] = []
+        try:
+            events.append(self.queue.get(timeout=timeout or None, block=timeout > 0))
+            while len(events) < max_events:
+                events.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        positions = range(self._read + 1, self._read + len(events) + 1)
+        self._read += len(events)
+        return list(zip(positions, events))
+
+    def commit(self, position: Position) -> None:
+        for _ in range(position - self._committed):
+            self.queue.task_done()
+        self._committed = position
+
+
+class TwinChangeConsumer:
+    """Consume change events in batches, keeping a local store of twins up-to-date.
+
+    Each batch is hydrated through the class registry, applied to the `store`, and passed
+    to each of the `handlers`. Only then is the batch committed to the source, so that
+    events are delivered at least once, even if processing is interrupted.
+
+    Events which cannot be parsed or applied, e.g. those failing validation, would
+    otherwise be redelivered forever. Instead, each is passed to `on_error` along with
+    the exception, acting as a dead-letter handler, and is excluded from the changes.
+
+    """
+
+    def __init__(
+        self,
+        source: EventSource,
+        store: Optional[MutableMapping[str, BaseModel]] = None,
+        handlers: Iterable[Callable[[list[TwinChange]], None]] = (),
+        batch_size: int = 100,
+        timeout: float = 1.0,
+        on_error: Optional[Callable[[dict[str, Any], Exception], None]] = None,
+    ):
+        self.source = source
+        self.store: MutableMapping[str, BaseModel] = {} if store is None else store
+        self.handlers = list(handlers)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.on_error = on_error
+
+    def _hydrate(self, event: TwinChangeEvent) -> Optional[BaseModel]:
+        if event.type == "delete":
+            return None
+
+        if event.type == "update":
+            current = self.store.get(event.twin_id)
+            if current is None:
+                return None
+            data = current.to_twin_dtdl()
+            apply_patch(data, event.patch)
+        else:
+            data = dict(event.data)
+
+        data["$dtId"] = event.twin_id
+        if event.model_id is not None:
+            data.setdefault("$metadata", {})["$model"] = event.model_id
+        try:
+            return BaseModel.from_twin_dtdl(**data)
+        except KeyError:
+            # The model is not registered in this process
+            return None
+
+    def poll(self) -> list[TwinChange]:
+        """Process and commit a single batch of events, returning the changes."""
+        events = self.source.read(self.batch_size, self.timeout)
+        if not events:
+            return []
+
+        changes = []
+        for _, raw_event in events:
+            try:
+                event = TwinChangeEvent.parse_event(raw_event)
+                twin = self._hydrate(event)
+            except (KeyError, TypeError, ValueError) as e:
+                if self.on_error is not None:
+                    self.on_error(raw_event, e)
+                continue
+            if twin is None:
+                self.store.pop(event.twin_id, None)
+            else:
+                self.store[event.twin_id] = twin
+            changes.append(TwinChange(event=event, twin=twin))
+
+        for handler in self.handlers:
+            handler(changes)
+
+        self.source.commit(events[-1][0])
+        return changes
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """Poll for events until `stop` is set."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.poll()
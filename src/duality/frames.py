@@ -0,0 +1,248 @@
+"""Construct twins in bulk from tabular data, using vectorized pandas operations.
+
+Rather than validating each row by constructing a model instance, each column is coerced
+to the type of its field as a whole, and the rows which fail are collected as errors.
+The resulting twin documents can be uploaded directly, without intermediate instances.
+
+Requires the optional `pandas` dependency.
+
+"""
+import datetime
+import os
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Iterator
+from typing import Literal
+from typing import Optional
+from typing import Type
+
+from duality.models import PRIMITIVE_SCHEMA_MAP
+from duality.models import BaseModel
+
+if TYPE_CHECKING:  # pragma: no cover
+    import pandas as pd
+
+# String representations of booleans, matching those accepted by pydantic
+_BOOL_VALUES = {
+    **dict.fromkeys(["true", "1", "1.0", "yes", "y", "on", "t"], True),
+    **dict.fromkeys(["false", "0", "0.0", "no", "n", "off", "f"], False),
+}
+
+
+def _to_string(series: "pd.Series") -> "pd.Series":
+    return series.astype(str)
+
+
+def _to_integer(series: "pd.Series") -> "pd.Series":
+    import pandas as pd
+
+    numbers = pd.to_numeric(series, errors="coerce")
+    # Values outside the range of int64 cannot be cast, and are invalid like fractions
+    valid = (numbers.mod(1) == 0) & numbers.ge(-(2**63)) & numbers.lt(2**63)
+    return numbers.where(valid).astype("Int64")
+
+
+def _to_double(series: "pd.Series") -> "pd.Series":
+    import pandas as pd
+
+    return pd.to_numeric(series, errors="coerce").astype(float)
+
+
+def _to_boolean(series: "pd.Series") -> "pd.Series":
+    if series.dtype == bool:
+        return series
+    return series.astype(str).str.lower().map(_BOOL_VALUES)
+
+
+def _parse_datetimes(series: "pd.Series") -> tuple["pd.Series", str]:
+    """Parse ISO 8601 datetimes, returning naive UTC timestamps if any had a timezone,
+    along with the suffix with which to format them.
+
+    """
+    import pandas as pd
+
+    try:
+        timestamps = pd.to_datetime(series, format="ISO8601", errors="coerce")
+    except ValueError:
+        # Mixed timezones can only be parsed by converting to UTC
+        timestamps = pd.to_datetime(series, format="ISO8601", errors="coerce", utc=True)
+    if timestamps.dt.tz is None:
+        return timestamps, ""
+    return timestamps.dt.tz_convert("UTC").dt.tz_localize(None), "Z"
+
+
+def _format_datetimes(
+    timestamps: "pd.Series", unit: Optional[Literal["D", "s", "us"]] = None
+) -> "pd.Series":
+    """Format timestamps as ISO 8601 strings, only including microseconds if needed."""
+    import numpy as np
+    import pandas as pd
+
+    values = timestamps.to_numpy(dtype="datetime64[us]")
+    if unit is None:
+        microseconds = values[timestamps.notna().to_numpy()].astype("int64") % 1_000_000
+        unit = "us" if microseconds.any() else "s"
+    strings = pd.Series(
+        np.datetime_as_string(values, unit=unit), index=timestamps.index
+    )
+    return strings.where(timestamps.notna())
+
+
+def _to_date(series: "pd.Series") -> "pd.Series":
+    timestamps, _ = _parse_datetimes(series)
+    return _format_datetimes(timestamps, unit="D")
+
+
+def _to_datetime(series: "pd.Series") -> "pd.Series":
+    timestamps, suffix = _parse_datetimes(series)
+    return _format_datetimes(timestamps) + suffix
+
+
+def _to_time(series: "pd.Series") -> "pd.Series":
+    timestamps, _ = _parse_datetimes("1970-01-01T" + series.astype(str))
+    return _format_datetimes(timestamps).str[len("1970-01-01T") :]
+
+
+def _to_duration(series: "pd.Series") -> "pd.Series":
+    """Format durations as ISO 8601 durations in seconds, e.g. "PT3600S"."""
+    import numpy as np
+    import pandas as pd
+
+    if pd.api.types.is_timedelta64_dtype(series):
+        durations = series
+    else:
+        # Numbers are read as seconds, as by pydantic, rather than as nanoseconds
+        numbers = pd.to_numeric(series, errors="coerce")
+        durations = pd.to_timedelta(series.where(numbers.isna()), errors="coerce")
+        durations = durations.where(numbers.isna(), pd.to_timedelta(numbers, unit="s"))
+
+    seconds = durations.dt.total_seconds()
+    sign = seconds.lt(0).map({True: "-", False: ""})
+    magnitude = seconds.abs().fillna(0)
+    fractional = magnitude.mod(1).ne(0)
+    strings = magnitude.astype("int64").astype(str)
+    strings.loc[fractional] = [
+        np.format_float_positional(value, trim="-") for value in magnitude[fractional]
+    ]
+    return (sign + "PT" + strings + "S").where(seconds.notna())
+
+
+def _uuid4_strings(count: int) -> list[str]:
+    """Generate random UUID strings in bulk, equivalent to `str(uuid.uuid4())`."""
+    import numpy as np
+
+    data = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(count, 16)
+    data = data.copy()
+    data[:, 6] = data[:, 6] & 0x0F | 0x40  # version 4
+    data[:, 8] = data[:, 8] & 0x3F | 0x80  # RFC 4122 variant
+    h = data.tobytes().hex()
+    return [
+        f"{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}"
+        for i in range(0, 32 * count, 32)
+    ]
+
+
+def _column(frame: "pd.DataFrame", name: str, alias: str) -> "pd.Series":
+    """Return the column of a field by either its name or alias, or a missing column."""
+    import pandas as pd
+
+    if name in frame:
+        return frame[name]
+    if alias in frame:
+        return frame[alias]
+    return pd.Series(None, index=frame.index, dtype=object)
+
+
+# A mapping of Python types to functions which coerce a column to JSON-compatible values,
+# returning a missing value wherever the coercion fails
+COLUMN_COERCERS: Dict[Type, Callable[["pd.Series"], "pd.Series"]] = {
+    str: _to_string,
+    int: _to_integer,
+    float: _to_double,
+    bool: _to_boolean,
+    datetime.date: _to_date,
+    datetime.datetime: _to_datetime,
+    datetime.time: _to_time,
+    datetime.timedelta: _to_duration,
+}
+
+
+class TwinFrame:
+    """Twin documents built from the columns of a table, along with the errors of any rows
+    which failed validation.
+
+    The `errors` are keyed by the index label of each invalid row, and invalid rows are
+    excluded from the documents.
+
+    """
+
+    def __init__(self, model: Type[BaseModel], data: Any):
+        import pandas as pd
+
+        frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        self.model = model
+        self.errors: dict[Hashable, list[str]] = {}
+        self.columns: dict[str, list[Any]] = {}
+
+        invalid = pd.Series(False, index=frame.index)
+        relationships = model.relationships()
+        for name, field in model.__fields__.items():
+            if name == "id" or name in relationships:
+                continue
+
+            if field.type_ not in PRIMITIVE_SCHEMA_MAP:
+                raise ValueError(f"Cannot handle field of type {field.type_} yet")
+            schema = PRIMITIVE_SCHEMA_MAP[field.type_]
+
+            column = _column(frame, name, field.alias)
+
+            missing = column.isna()
+            if not field.required and field.default is not None:
+                column = column.where(~missing, field.default)
+                missing = column.isna()
+
+            values = COLUMN_COERCERS[field.type_](column).where(~missing)
+            failed = values.isna() & ~missing
+            if field.required:
+                failed |= missing
+
+            for label, is_missing in zip(frame.index[failed], missing[failed]):
+                message = "field required" if is_missing else f"not a valid {schema}"
+                self.errors.setdefault(label, []).append(f"{name}: {message}")
+            invalid |= failed
+
+            values = values.astype(object)
+            self.columns[name] = values.where(values.notna(), None).tolist()
+
+        ids = _column(frame, "id", model.__fields__["id"].alias)
+        if ids.isna().all():
+            self.ids = _uuid4_strings(len(frame))
+        else:
+            for label in frame.index[ids.isna()]:
+                self.errors.setdefault(label, []).append(
+                    "id: none is not an allowed value"
+                )
+            invalid |= ids.isna()
+            self.ids = ids.astype(str).tolist()
+        self._valid = (~invalid).tolist()
+
+    def __len__(self) -> int:
+        """The number of valid rows."""
+        return sum(self._valid)
+
+    def to_twin_dtdl(self) -> Iterator[dict[str, Any]]:
+        """Yield a dtdl representation of each valid row, suitable for upload."""
+        metadata = {"$model": self.model.id}
+        names = list(self.columns)
+        for twin_id, valid, *values in zip(
+            self.ids, self._valid, *self.columns.values()
+        ):
+            if valid:
+                document = {"$dtId": twin_id, "$metadata": metadata}
+                for name, value in zip(names, values):
+                    if value is not None:
+                        document[name] = value
+                yield document
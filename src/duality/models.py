@@ -1,8 +1,16 @@
 import datetime
+import importlib
+import json
+import os
 import re
+import sys
 import uuid
+from collections import deque
+from typing import TYPE_CHECKING
 from typing import Any
 from typing import Dict
+from typing import Iterator
+from typing import Mapping
 from typing import Optional
 from typing import Type
 from typing import Union
@@ -11,6 +19,9 @@ import pydantic
 
 from duality import dtdl
 
+if TYPE_CHECKING:  # pragma: no cover
+    from duality.frames import TwinFrame
+
 # A mapping of Python types to DTDL primitive schemas
 PRIMITIVE_SCHEMA_MAP: Dict[Type, str] = {
     str: "string",
@@ -40,6 +51,7 @@ class ModelMetaclass(pydantic.main.ModelMetaclass):
     __model_prefix__: str
     __model_name__: str
     __model_version__: int
+    __model_id__: Optional[dtdl.DTMI]
 
     @property
     def model_prefix(cls) -> str:
@@ -53,6 +65,7 @@ class ModelMetaclass(pydantic.main.ModelMetaclass):
     @model_prefix.setter
     def model_prefix(cls, value: str) -> None:
         cls.__model_prefix__ = value
+        cls.__model_id__ = None
 
     @property
     def model_name(cls) -> str:
@@ -64,6 +77,7 @@ class ModelMetaclass(pydantic.main.ModelMetaclass):
     @model_name.setter
     def model_name(cls, value: str) -> None:
         cls.__model_name__ = value
+        cls.__model_id__ = None
 
     @property
     def model_version(cls) -> int:
@@ -72,13 +86,68 @@ class ModelMetaclass(pydantic.main.ModelMetaclass):
     @model_version.setter
     def model_version(cls, value: int) -> None:
         cls.__model_version__ = int(value)
+        cls.__model_id__ = None
 
     @property
     def id(cls) -> dtdl.DTMI:
-        return dtdl.DTMI(
-            path=f"{cls.model_prefix}:{cls.model_name}",
-            version=cls.model_version,
-        )
+        """The DTMI of the model, which is cached until one of its components changes."""
+        # Read from the class namespace directly, since subclasses have their own id
+        model_id = cls.__dict__.get("__model_id__")
+        if model_id is None:
+            model_id = dtdl.DTMI(
+                path=f"{cls.model_prefix}:{cls.model_name}",
+                version=cls.model_version,
+            )
+            cls.__model_id__ = model_id
+        return model_id
+
+
+class _ClassRegistry(Mapping[str, Type["BaseModel"]]):
+    """A mapping of model id to model class, which is built lazily.
+
+    Classes are queued when they are defined, and their ids are only computed the first
+    time the registry is read. Entries may also be references of the form
+    "module:qualname", in which case the module is imported upon first access.
+
+    """
+
+    def __init__(self) -> None:
+        self._pending: deque[Type["BaseModel"]] = deque()
+        self._classes: dict[str, Union[str, Type["BaseModel"]]] = {}
+
+    def add(self, class_: Type["BaseModel"]) -> None:
+        """Queue a class for registration."""
+        self._pending.append(class_)
+
+    def add_reference(self, model_id: str, reference: str) -> None:
+        """Register a "module:qualname" reference to a class, unless already registered."""
+        self._resolve_pending()
+        self._classes.setdefault(model_id, reference)
+
+    def _resolve_pending(self) -> None:
+        while self._pending:
+            class_ = self._pending.popleft()
+            self._classes[class_.id] = class_
+
+    def __getitem__(self, model_id: str) -> Type["BaseModel"]:
+        self._resolve_pending()
+        class_ = self._classes[model_id]
+        if isinstance(class_, str):
+            module_name, _, qualname = class_.partition(":")
+            obj: Any = importlib.import_module(module_name)
+            for name in qualname.split("."):
+                obj = getattr(obj, name)
+            self._resolve_pending()
+            self._classes[model_id] = class_ = obj
+        return class_  # type: ignore
+
+    def __iter__(self) -> Iterator[str]:
+        self._resolve_pending()
+        return iter(list(self._classes))
+
+    def __len__(self) -> int:
+        self._resolve_pending()
+        return len(self._classes)
 
 
 def _get_schema(field_type: Type) -> str:
@@ -98,7 +167,7 @@ class BaseModel(pydantic.BaseModel, metaclass=ModelMetaclass):
 
     id: str = pydantic.Field(alias="$dtId", default_factory=lambda: str(uuid.uuid4()))
 
-    _class_registry: dict[str, Type["BaseModel"]] = {}
+    _class_registry: _ClassRegistry = _ClassRegistry()
 
     def __init_subclass__(
         cls, model_prefix: str = "", model_name: str = "", model_version: int = 1
@@ -107,7 +176,7 @@ class BaseModel(pydantic.BaseModel, metaclass=ModelMetaclass):
         cls.model_prefix = model_prefix
         cls.model_name = model_name
         cls.model_version = model_version
-        cls._class_registry[cls.id] = cls
+        cls._class_registry.add(cls)
 
     @property
     def model_id(self) -> dtdl.DTMI:
@@ -145,11 +214,32 @@ class BaseModel(pydantic.BaseModel, metaclass=ModelMetaclass):
             id=cls.id, displayName=cls.__name__, contents=contents, extends=extends
         )
 
+    @classmethod
+    def relationships(cls) -> Dict[str, Type["BaseModel"]]:
+        """Return the target model of each relationship field, including inherited ones."""
+        return {
+            name: field.type_
+            for name, field in cls.__fields__.items()
+            if isinstance(field.default, Relationship)
+        }
+
     @classmethod
     def to_dict(cls) -> Dict[str, Any]:
         """Return the class interface as a DTDL schema dictionary."""
         return cls.to_interface().dict()
 
+    @classmethod
+    def from_frame(cls, data: Any) -> "TwinFrame":
+        """Validate a pandas DataFrame, or a mapping of column names to values, in bulk.
+
+        Returns a `TwinFrame` of the twin documents of valid rows, and the errors of
+        invalid rows. Requires the optional `pandas` dependency.
+
+        """
+        from duality.frames import TwinFrame
+
+        return TwinFrame(cls, data)
+
     @classmethod
     def from_twin_dtdl(cls, **data: Any) -> "BaseModel":
         """Construct an object based on ADT response data, using the class registry."""
@@ -160,13 +250,67 @@ class BaseModel(pydantic.BaseModel, metaclass=ModelMetaclass):
     def to_twin_dtdl(self) -> dict[str, Any]:
         """Return a dtdl representation of the instance."""
         data = {"$metadata": {"$model": self.model_id}}
-        ignored = {"id"}
+        # Relationships are stored as edges, rather than as properties of the twin
+        ignored = {"id", *self.relationships()}
         for key in self.__fields__:
             if key not in ignored:
                 data[key] = getattr(self, key)
         return data
 
 
+def _class_reference(class_: Type["BaseModel"]) -> Optional[str]:
+    """Return a "module:qualname" reference to a class, or `None` if another process
+    could not resolve it, e.g. for classes defined within functions or in `__main__`.
+
+    """
+    if class_.__module__ == "__main__" or "<locals>" in class_.__qualname__:
+        return None
+    obj: Any = sys.modules.get(class_.__module__)
+    for name in class_.__qualname__.split("."):
+        obj = getattr(obj, name, None)
+    if obj is not class_:
+        return None
+    return f"{class_.__module__}:{class_.__qualname__}"
+
+
+def save_registry(path: Union[str, os.PathLike]) -> None:
+    """Serialize the class registry, along with each model's interface, to a JSON file.
+
+    Loading the file with `load_registry` allows a process to hydrate twins without first
+    importing every module that defines a model. Classes which cannot be imported by
+    reference, such as those defined within functions or in `__main__`, are skipped.
+
+    """
+    registry = BaseModel._class_registry
+    data = {}
+    for model_id in registry:
+        class_ = registry[model_id]
+        reference = _class_reference(class_)
+        if reference is None:
+            continue
+        data[model_id] = {
+            "class": reference,
+            "interface": class_.to_dict(),
+        }
+    with open(path, "w") as fp:
+        json.dump(data, fp)
+
+
+def load_registry(path: Union[str, os.PathLike]) -> Dict[str, dtdl.Interface]:
+    """Register lazy class references from a file written by `save_registry`.
+
+    Returns the serialized interfaces, keyed by model id.
+
+    """
+    with open(path) as fp:
+        data = json.load(fp)
+    interfaces = {}
+    for model_id, entry in data.items():
+        BaseModel._class_registry.add_reference(model_id, entry["class"])
+        interfaces[model_id] = dtdl.Interface(**entry["interface"])
+    return interfaces
+
+
 class Relationship:
     """A relationship from one Model to another."""
 
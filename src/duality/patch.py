@@ -0,0 +1,21 @@
+"""Apply JSON patches, as used by ADT to update twins, to local twin documents."""
+from typing import Any
+from typing import Iterable
+
+
+def apply_patch(data: dict[str, Any], patch: Iterable[dict[str, Any]]) -> None:
+    """Apply the add, replace, and remove operations of a JSON patch in-place."""
+    for op in patch:
+        keys = [
+            key.replace("~1", "/").replace("~0", "~")
+            for key in op["path"].lstrip("/").split("/")
+        ]
+        parent = data
+        for key in keys[:-1]:
+            parent = parent.setdefault(key, {})
+        if op["op"] == "remove":
+            parent.pop(keys[-1], None)
+        elif op["op"] in ("add", "replace"):
+            parent[keys[-1]] = op["value"]
+        else:
+            raise ValueError(f"Unsupported patch operation: {op['op']}")
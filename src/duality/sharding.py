@@ -0,0 +1,274 @@
+"""Spread twins across multiple ADT instances, to scale past the limits of a single one.
+
+Twins are routed to a single shard by a shard key, models are deployed to every shard,
+and queries are fanned out to all shards in parallel, with their results merged.
+
+"""
+import itertools
+import zlib
+from typing import Any
+from typing import Callable
+from typing import Generator
+from typing import Generic
+from typing import Iterable
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Type
+from typing import TypeVar
+from typing import Union
+
+from duality import dtdl
+from duality.adt import ADTClient
+from duality.adt import ADTQuery
+from duality.adt import ModelDiff
+from duality.adt import QueryStats
+from duality.adt import TwinLookup
+from duality.adt import _run_parallel
+from duality.models import BaseModel
+from duality.models import ModelMetaclass
+
+T = TypeVar("T", bound=BaseModel)
+
+# A function of a twin's `$dtId`, its model id, and the number of shards, which returns
+# the index of the twin's shard
+ShardKey = Callable[[str, str, int], int]
+
+
+def hash_shard_key(twin_id: str, model_id: str, shard_count: int) -> int:
+    """Route twins by a stable hash of their `$dtId`."""
+    return zlib.crc32(twin_id.encode()) % shard_count
+
+
+def model_prefix_shard_key(
+    prefixes: Mapping[str, int], default: ShardKey = hash_shard_key
+) -> ShardKey:
+    """Route twins by the longest matching prefix of their model id.
+
+    For example, `{"dtmi:duality:pets": 1}` places all twins of models under
+    "dtmi:duality:pets" in the second shard. Twins of other models are routed by `default`.
+
+    """
+    ordered = sorted(prefixes.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def shard_key(twin_id: str, model_id: str, shard_count: int) -> int:
+        for prefix, index in ordered:
+            if model_id.startswith(prefix):
+                return index
+        return default(twin_id, model_id, shard_count)
+
+    return shard_key
+
+
+def _raise_first(errors: Mapping[Any, Exception]) -> None:
+    for error in errors.values():
+        raise error
+
+
+class ShardedADTQuery(Generic[T]):
+    """A query which is executed against every shard in parallel."""
+
+    def __init__(self, queries: Sequence[ADTQuery]):
+        self._queries = queries
+
+    def of_model(self, model_class: Type[T], exact: bool = False) -> "ShardedADTQuery":
+        """Filter results to return instances of a single model type."""
+        for query in self._queries:
+            query.of_model(model_class, exact)
+        return self
+
+    def where_in(self, field: str, values: Iterable[str]) -> "ShardedADTQuery":
+        """Filter results to those whose `field` is one of the `values`."""
+        values = list(values)
+        for query in self._queries:
+            query.where_in(field, values)
+        return self
+
+    def budget(self, max_charge: float) -> "ShardedADTQuery":
+        """Abort the query once its charge on any one shard exceeds `max_charge`."""
+        for query in self._queries:
+            query.budget(max_charge)
+        return self
+
+    @property
+    def stats(self) -> QueryStats:
+        """The cost of the query, summed over all shards."""
+        return _sum_stats(query.stats for query in self._queries)
+
+    def count(self) -> int:
+        """Return the number of objects returned by the query, over all shards."""
+        counts, errors = _run_parallel(
+            lambda i: self._queries[i].count(),
+            range(len(self._queries)),
+            len(self._queries),
+        )
+        _raise_first(errors)
+        return sum(counts.values())
+
+    def all(self, max_pages: int = 2) -> Generator[T, None, None]:
+        """Return a generator of all objects returned by the query, over all shards.
+
+        Each shard is read by a prefetching iterator, such that all shards are queried
+        in parallel, while buffering at most `max_pages` pages per shard.
+
+        """
+        iterators = [query.prefetch(max_pages) for query in self._queries]
+        try:
+            yield from itertools.chain.from_iterable(iterators)
+        finally:
+            for iterator in iterators:
+                iterator.close()
+
+
+def _sum_stats(all_stats: Iterable[QueryStats]) -> QueryStats:
+    total = QueryStats()
+    for stats in all_stats:
+        for name in total.__fields__:
+            setattr(total, name, getattr(total, name) + getattr(stats, name))
+    return total
+
+
+class ShardedADTClient:
+    """A client which spreads twins across several ADT instances.
+
+    Twins are routed by `shard_key`, which defaults to a hash of the `$dtId`, whereas
+    models are deployed to all shards. Operations across shards use at most
+    `concurrency` parallel requests, defaulting to one per shard.
+
+    """
+
+    def __init__(
+        self,
+        shards: Sequence[ADTClient],
+        shard_key: ShardKey = hash_shard_key,
+        concurrency: Optional[int] = None,
+    ):
+        if not shards:
+            raise ValueError("At least one shard is required")
+        self.shards = list(shards)
+        self.shard_key = shard_key
+        self.concurrency = concurrency or len(self.shards)
+
+    def shard_for(self, twin_id: str, model_id: str) -> ADTClient:
+        """Return the shard which stores the twin."""
+        return self.shards[self.shard_key(twin_id, model_id, len(self.shards))]
+
+    def _on_all_shards(self, func: Callable[[ADTClient], Any]) -> list[Any]:
+        results, errors = _run_parallel(
+            lambda i: func(self.shards[i]), range(len(self.shards)), self.concurrency
+        )
+        _raise_first(errors)
+        return [results[i] for i in range(len(self.shards))]
+
+    @property
+    def query(self) -> ShardedADTQuery:
+        return ShardedADTQuery([shard.query for shard in self.shards])
+
+    @property
+    def query_stats(self) -> QueryStats:
+        """The cost of all queries, summed over all shards."""
+        return _sum_stats(shard.query_stats for shard in self.shards)
+
+    def upload_model(self, model: Type[BaseModel], exist_ok: bool = True) -> list[Any]:
+        """Upload the model to every shard."""
+        return self._on_all_shards(lambda shard: shard.upload_model(model, exist_ok))
+
+    def sync_models(
+        self,
+        models: Optional[Iterable[Union[Type[BaseModel], ModelMetaclass]]] = None,
+        decommission: bool = True,
+    ) -> list[ModelDiff]:
+        """Synchronize the models on every shard, returning the diff of each.
+
+        The shards are planned together, such that every shard deploys the same version
+        of each model, namely the highest version required by any shard. The shards are
+        then synchronized in parallel, after which each model class is pinned to its
+        deployed version.
+
+        """
+        models = ADTClient._local_models(models)
+        deployed = self._on_all_shards(lambda shard: shard._deployed_models())
+
+        versions: dict[str, int] = {}
+        while True:
+            plans = [
+                shard._plan_models(models, shard_deployed, versions)
+                for shard, shard_deployed in zip(self.shards, deployed)
+            ]
+            # Planning with higher versions may require yet higher versions on a shard
+            # where such a version is deployed with a different definition
+            required = dict(versions)
+            for diff, _ in plans:
+                for model_id in diff.ids.values():
+                    _, path, version = dtdl.DTMI.parts_from_string(model_id)
+                    required[path] = max(required.get(path, 0), int(version))
+            if required == versions:
+                break
+            versions = required
+
+        _, errors = _run_parallel(
+            lambda i: self.shards[i]._apply_plan(*plans[i], decommission),
+            range(len(self.shards)),
+            self.concurrency,
+        )
+        _raise_first(errors)
+        ADTClient._pin_models(models, plans[0][0])
+        return [diff for diff, _ in plans]
+
+    def delete_model(self, model: Type[BaseModel]) -> None:
+        """Delete the model from every shard."""
+        self._on_all_shards(lambda shard: shard.delete_model(model))
+
+    def get(self, model: Type[T], twin_id: str) -> T:
+        """Fetch a single twin by id from its shard.
+
+        The shard is found using the id of `model`, which must therefore be the twin's
+        exact model when routing by model prefix.
+
+        """
+        return self.shard_for(twin_id, model.id).get(model, twin_id)
+
+    def get_many(
+        self,
+        twin_ids: Iterable[str],
+        model: Optional[Type[BaseModel]] = None,
+        concurrency: int = 8,
+    ) -> TwinLookup:
+        """Fetch many twins by id, querying each shard in parallel for its own twins.
+
+        The shard of each twin is found using the id of `model`, which must therefore be
+        the twins' exact model when routing by model prefix. Without a `model`, only
+        twins routed by `hash_shard_key` can be found from their id alone, so every
+        shard is queried for all of the twins when using any other shard key.
+
+        """
+        twin_ids = list(dict.fromkeys(twin_ids))
+        by_shard: dict[int, list[str]] = {}
+        if model is None and self.shard_key is not hash_shard_key:
+            by_shard = dict.fromkeys(range(len(self.shards)), twin_ids)
+        else:
+            model_id = model.id if model is not None else ""
+            for twin_id in twin_ids:
+                index = self.shard_key(twin_id, model_id, len(self.shards))
+                by_shard.setdefault(index, []).append(twin_id)
+
+        lookups, errors = _run_parallel(
+            lambda i: self.shards[i].get_many(by_shard[i], model, concurrency),
+            by_shard,
+            self.concurrency,
+        )
+        _raise_first(errors)
+
+        found: dict[str, BaseModel] = {}
+        for lookup in lookups.values():
+            found.update(lookup.found)
+        return TwinLookup(
+            {i: found[i] for i in twin_ids if i in found},
+            [i for i in twin_ids if i not in found],
+        )
+
+    def upload_twin(self, instance: BaseModel) -> BaseModel:
+        return self.shard_for(instance.id, instance.model_id).upload_twin(instance)
+
+    def delete_twin(self, instance: BaseModel) -> None:
+        self.shard_for(instance.id, instance.model_id).delete_twin(instance)
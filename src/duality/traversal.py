@@ -0,0 +1,79 @@
+"""Traverse the twin graph along the relationship fields declared on models.
+
+Each level of the traversal is expanded with batched queries over the whole frontier,
+run in parallel, rather than a query per twin, such that a traversal requires a number of round trips
+proportional to its depth rather than to the number of twins.
+
+"""
+from typing import Generator
+from typing import Iterable
+from typing import NamedTuple
+from typing import Optional
+from typing import Type
+
+from duality.adt import ADTClient
+from duality.models import BaseModel
+
+
+class TraversalNode(NamedTuple):
+    """A twin reached by a traversal, along with the edge it was first reached by."""
+
+    twin: BaseModel
+    depth: int
+    source_id: Optional[str] = None
+    relationship_name: Optional[str] = None
+
+
+def traverse(
+    client: ADTClient,
+    roots: Iterable[BaseModel],
+    max_depth: Optional[int] = None,
+    models: Optional[Iterable[Type[BaseModel]]] = None,
+) -> Generator[TraversalNode, None, None]:
+    """Breadth-first traversal of the twins reachable from the `roots`.
+
+    Only relationships declared as `Relationship` fields on the model of each twin are
+    followed. Each twin is yielded once, as soon as it has been hydrated, even if the
+    graph contains cycles. The roots are yielded first, with a depth of zero, and are
+    always expanded.
+
+    Args:
+        client: The client used to query ADT.
+        roots: The twins from which to start the traversal.
+        max_depth: The maximum number of relationships to follow from the roots.
+        models: If provided, only twins reached from the roots which are instances of
+            these models are yielded and expanded further.
+
+    """
+    model_filter = tuple(models) if models is not None else (BaseModel,)
+
+    frontier = {root.id: root for root in roots}
+    visited = set(frontier)
+    for root in frontier.values():
+        yield TraversalNode(root, 0)
+
+    depth = 0
+    while frontier and (max_depth is None or depth < max_depth):
+        depth += 1
+
+        relationship_names = {
+            twin_id: set(twin.relationships()) for twin_id, twin in frontier.items()
+        }
+        sources = [twin_id for twin_id, names in relationship_names.items() if names]
+        all_names = set().union(*relationship_names.values())
+
+        # Find the first edge by which each unvisited twin is reached
+        edges: dict[str, tuple[str, str]] = {}
+        for data in client.find_relationships(sources, ["$sourceId"], all_names):
+            source_id = str(data["$sourceId"])
+            name = str(data["$relationshipName"])
+            target_id = str(data["$targetId"])
+            if name in relationship_names[source_id] and target_id not in visited:
+                edges.setdefault(target_id, (source_id, name))
+        visited.update(edges)
+
+        frontier = {}
+        for twin in client.get_many(edges).found.values():
+            if isinstance(twin, model_filter):
+                frontier[twin.id] = twin
+                yield TraversalNode(twin, depth, *edges[twin.id])
@@ -1,4 +1,16 @@
+import json
+import re
+import threading
+from types import SimpleNamespace
+from typing import Any
+
 import pytest
+from azure.core.exceptions import HttpResponseError
+from azure.core.exceptions import ResourceExistsError
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.paging import ItemPaged
+
+from duality.adt import ADTClient
 
 
 def _monkey_patch_parametrize() -> None:
@@ -22,3 +34,233 @@ def _monkey_patch_parametrize() -> None:
 
 
 _monkey_patch_parametrize()
+
+
+class InMemoryDigitalTwinsClient:
+    """An in-memory stand-in for `azure.digitaltwins.core.DigitalTwinsClient`.
+
+    Only the subset of the query language generated by `duality` is supported.
+
+    """
+
+    def __init__(self, page_size: int = 10) -> None:
+        self.page_size = page_size
+        self.twins: dict[str, dict[str, Any]] = {}
+        self.relationships: dict[tuple[str, str], dict[str, Any]] = {}
+        self.models: dict[str, dict[str, Any]] = {}
+        self.queries: list[str] = []
+        self._lock = threading.Lock()
+
+    # Models
+
+    def create_models(self, dtdl_models: list[dict[str, Any]], **_: Any) -> list[Any]:
+        with self._lock:
+            for model in dtdl_models:
+                if model["@id"] in self.models:
+                    raise ResourceExistsError(f"Model {model['@id']} exists")
+            for model in dtdl_models:
+                self.models[model["@id"]] = {"model": model, "decommissioned": False}
+        return [self._model_data(model["@id"], True) for model in dtdl_models]
+
+    def _model_data(self, model_id: str, include_model_definition: bool) -> Any:
+        entry = self.models[model_id]
+        return SimpleNamespace(
+            id=model_id,
+            model=entry["model"] if include_model_definition else None,
+            decommissioned=entry["decommissioned"],
+        )
+
+    def get_model(self, model_id: str, **kwargs: Any) -> Any:
+        if model_id not in self.models:
+            raise ResourceNotFoundError(f"Model {model_id} not found")
+        return self._model_data(model_id, kwargs.get("include_model_definition", False))
+
+    def list_models(self, dependencies_for: Any = None, **kwargs: Any) -> Any:
+        return iter(
+            [
+                self._model_data(
+                    model_id, kwargs.get("include_model_definition", False)
+                )
+                for model_id in list(self.models)
+            ]
+        )
+
+    def decommission_model(self, model_id: str, **_: Any) -> None:
+        self.get_model(model_id)
+        self.models[model_id]["decommissioned"] = True
+
+    def delete_model(self, model_id: str, **_: Any) -> None:
+        with self._lock:
+            if model_id not in self.models:
+                raise ResourceNotFoundError(f"Model {model_id} not found")
+            for other in self.models.values():
+                if self._bases(other["model"]) & {model_id}:
+                    raise ResourceExistsError(f"Model {model_id} is extended")
+            del self.models[model_id]
+
+    @staticmethod
+    def _bases(model: dict[str, Any]) -> set[str]:
+        extends = model.get("extends") or []
+        return {extends} if isinstance(extends, str) else set(extends)
+
+    def _is_of_model(self, model_id: str, target: str, exact: bool) -> bool:
+        if model_id == target:
+            return True
+        if exact or model_id not in self.models:
+            return False
+        return any(
+            self._is_of_model(base, target, exact)
+            for base in self._bases(self.models[model_id]["model"])
+        )
+
+    # Twins
+
+    def upsert_digital_twin(
+        self, digital_twin_id: str, digital_twin: dict[str, Any], **kwargs: Any
+    ) -> Any:
+        data = json.loads(json.dumps(digital_twin, default=str))
+        data["$dtId"] = digital_twin_id
+        with self._lock:
+            self.twins[digital_twin_id] = data
+        cls = kwargs.get("cls")
+        return cls(None, data, {}) if cls else data
+
+    def update_digital_twin(
+        self, digital_twin_id: str, json_patch: list[dict[str, Any]], **_: Any
+    ) -> None:
+        twin = self.get_digital_twin(digital_twin_id)
+        for op in json_patch:
+            key = op["path"].lstrip("/")
+            if op["op"] in ("remove", "replace") and key not in twin:
+                raise HttpResponseError(f"Path {op['path']} does not exist")
+            if op["op"] == "remove":
+                del twin[key]
+            else:
+                twin[key] = op["value"]
+
+    def get_digital_twin(self, digital_twin_id: str, **_: Any) -> dict[str, Any]:
+        try:
+            return self.twins[digital_twin_id]
+        except KeyError:
+            raise ResourceNotFoundError(f"Twin {digital_twin_id} not found")
+
+    def delete_digital_twin(self, digital_twin_id: str, **_: Any) -> None:
+        with self._lock:
+            if digital_twin_id not in self.twins:
+                raise ResourceNotFoundError(f"Twin {digital_twin_id} not found")
+            for relationship in self.relationships.values():
+                if digital_twin_id in (
+                    relationship["$sourceId"],
+                    relationship["$targetId"],
+                ):
+                    raise HttpResponseError(f"Twin {digital_twin_id} has relationships")
+            del self.twins[digital_twin_id]
+
+    # Relationships
+
+    def upsert_relationship(
+        self,
+        digital_twin_id: str,
+        relationship_id: str,
+        relationship: dict[str, Any],
+        **_: Any,
+    ) -> dict[str, Any]:
+        data = {
+            **relationship,
+            "$sourceId": digital_twin_id,
+            "$relationshipId": relationship_id,
+        }
+        with self._lock:
+            self.relationships[(digital_twin_id, relationship_id)] = data
+        return data
+
+    def delete_relationship(
+        self, digital_twin_id: str, relationship_id: str, **_: Any
+    ) -> None:
+        with self._lock:
+            try:
+                del self.relationships[(digital_twin_id, relationship_id)]
+            except KeyError:
+                raise ResourceNotFoundError(f"Relationship {relationship_id} not found")
+
+    # Queries
+
+    def query_twins(self, query_expression: str, **kwargs: Any) -> ItemPaged:
+        self.queries.append(query_expression)
+        match = re.fullmatch(
+            r"SELECT (?P<selector>.+?) FROM (?P<collection>\w+)(?: WHERE (?P<where>.*))?",
+            query_expression,
+        )
+        assert match is not None, f"Unsupported query: {query_expression}"
+        collections: dict[str, dict[Any, dict[str, Any]]] = {
+            "digitaltwins": self.twins,
+            "relationships": self.relationships,
+        }
+        collection = collections[match["collection"]]
+        conditions = match["where"].split(" AND ") if match["where"] else []
+        with self._lock:
+            rows = [
+                row
+                for row in collection.values()
+                if all(self._matches(row, c) for c in conditions)
+            ]
+
+        selector = match["selector"]
+        if selector == "COUNT()":
+            rows = [{"COUNT": len(rows)}]
+        elif selector != "*":
+            fields = [f.strip() for f in selector.split(",")]
+            rows = [{f: row[f] for f in fields if f in row} for row in rows]
+
+        pages = [
+            rows[i : i + self.page_size] for i in range(0, len(rows), self.page_size)
+        ] or [[]]
+
+        def get_next(token: Any = None) -> Any:
+            index = int(token or 0)
+            next_token = str(index + 1) if index + 1 < len(pages) else None
+            response = SimpleNamespace(
+                value=pages[index], continuation_token=next_token
+            )
+            cls = kwargs.get("cls")
+            if cls is None:
+                return response
+            # Charge one query unit per page, plus one per row
+            body = json.dumps(pages[index]).encode()
+            pipeline_response = SimpleNamespace(
+                http_response=SimpleNamespace(body=lambda: body)
+            )
+            headers = {"query-charge": 1.0 + len(pages[index])}
+            return cls(pipeline_response, response, headers)
+
+        def extract_data(response: Any) -> Any:
+            return response.continuation_token, iter(response.value)
+
+        return ItemPaged(get_next, extract_data)
+
+    def _matches(self, row: dict[str, Any], condition: str) -> bool:
+        match = re.fullmatch(r"IS_OF_MODEL\('(.+?)'(, exact)?\)", condition)
+        if match:
+            model_id = row["$metadata"]["$model"]
+            return self._is_of_model(model_id, match[1], bool(match[2]))
+        match = re.fullmatch(r"(\$?\w+) IN \[(.*)\]", condition)
+        assert match is not None, f"Unsupported condition: {condition}"
+        values = re.findall(r"'((?:[^'\\]|\\.)*)'", match[2])
+        return row.get(match[1]) in values
+
+
+@pytest.fixture()
+def service_client() -> InMemoryDigitalTwinsClient:
+    return InMemoryDigitalTwinsClient()
+
+
+@pytest.fixture()
+def local_adt_client(service_client: InMemoryDigitalTwinsClient) -> ADTClient:
+    """An `ADTClient` backed by an in-memory service client."""
+    return ADTClient(service_client)  # type: ignore
+
+
+@pytest.fixture()
+def service_clients() -> list[InMemoryDigitalTwinsClient]:
+    """Several independent in-memory service clients, e.g. to act as shards."""
+    return [InMemoryDigitalTwinsClient() for _ in range(3)]
@@ -0,0 +1,404 @@
+"""Tests of the `ADTClient` against an in-memory stand-in for the ADT service."""
+import time
+from typing import Any
+from typing import Iterator
+from typing import Type
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+from duality.adt import ADTClient
+from duality.adt import PrefetchingIterator
+from duality.adt import QueryBudgetExceeded
+from duality.adt import _topological_order
+from duality.models import BaseModel
+from duality.models import Relationship
+
+
+class Site(BaseModel, model_prefix="duality:local"):
+    name: str
+
+
+class Building(Site, model_prefix="duality:local"):
+    floors: int
+
+
+class Floor(BaseModel, model_prefix="duality:local"):
+    level: int
+
+
+def _relate(service_client: Any, source: BaseModel, target: BaseModel) -> None:
+    service_client.upsert_relationship(
+        source.id,
+        f"{source.id}-{target.id}",
+        {"$targetId": target.id, "$relationshipName": "contains"},
+    )
+
+
+def test_topological_order() -> None:
+    extends = {"c": ["b"], "b": ["a"], "a": [], "d": ["a", "external"]}
+    order = _topological_order(extends)
+    assert order.index("a") < order.index("b") < order.index("c")
+    assert order.index("a") < order.index("d")
+
+
+def test_purge_model(service_client: Any, local_adt_client: ADTClient) -> None:
+    for model in (Site, Building, Floor):
+        local_adt_client.upload_model(model)
+    site = local_adt_client.upload_twin(Site(name="Site"))
+    buildings = [
+        local_adt_client.upload_twin(Building(name=f"B{i}", floors=i))
+        for i in range(25)
+    ]
+    floors = [local_adt_client.upload_twin(Floor(level=i)) for i in range(3)]
+    for building in buildings:
+        _relate(service_client, site, building)
+    _relate(service_client, buildings[0], floors[0])
+
+    summary = local_adt_client.purge(Site, concurrency=4)
+
+    assert summary.twins_deleted == 26
+    assert summary.relationships_deleted == 26
+    assert summary.models_deleted == [Building.id, Site.id]
+    assert summary.failed == {}
+    assert set(service_client.twins) == {floor.id for floor in floors}
+    assert set(service_client.models) == {Floor.id}
+
+
+def test_purge_everything(service_client: Any, local_adt_client: ADTClient) -> None:
+    for model in (Site, Building, Floor):
+        local_adt_client.upload_model(model)
+    building = local_adt_client.upload_twin(Building(name="B", floors=1))
+    floor = local_adt_client.upload_twin(Floor(level=1))
+    _relate(service_client, building, floor)
+
+    summary = local_adt_client.purge()
+
+    assert summary.twins_deleted == 2
+    assert summary.relationships_deleted == 1
+    assert summary.models_deleted.index(Building.id) < summary.models_deleted.index(
+        Site.id
+    )
+    assert not service_client.twins
+    assert not service_client.models
+
+
+def test_purge_reports_failures(
+    service_client: Any, local_adt_client: ADTClient
+) -> None:
+    local_adt_client.upload_model(Floor)
+    floor = local_adt_client.upload_twin(Floor(level=1))
+
+    def fail(_: str) -> None:
+        raise RuntimeError("throttled")
+
+    service_client.delete_digital_twin = fail
+    summary = local_adt_client.purge(local_adt_client.query.of_model(Floor))
+
+    assert summary.twins_deleted == 0
+    assert summary.failed == {floor.id: "throttled"}
+    assert Floor.id in service_client.models
+
+
+def test_prefetch(service_client: Any, local_adt_client: ADTClient) -> None:
+    floors = {local_adt_client.upload_twin(Floor(level=i)).id for i in range(35)}
+
+    with local_adt_client.query.of_model(Floor).prefetch(max_rows=20) as results:
+        assert {floor.id for floor in results} == floors
+        assert results.buffered_rows == 0
+        assert results.fetch_wait_time >= 0.0
+
+
+def test_prefetch_limits_bytes(local_adt_client: ADTClient) -> None:
+    for i in range(35):
+        local_adt_client.upload_twin(Floor(level=i))
+
+    query = local_adt_client.query.of_model(Floor)
+    with query.prefetch(max_pages=10, max_bytes=1) as results:
+        next(results)
+        time.sleep(0.05)
+        # Only a single page is buffered, since each page exceeds the limit
+        assert results.buffered_pages == 1
+        assert results.buffered_bytes > 1
+        assert len(list(results)) == 34
+
+
+def test_prefetch_respects_limits(service_client: Any) -> None:
+    pages_fetched = []
+
+    def pages() -> Iterator[Iterator[dict[str, Any]]]:
+        for i in range(5):
+            pages_fetched.append(i)
+            yield iter(
+                [{"$dtId": str(i), "$metadata": {"$model": Floor.id}, "level": i}]
+            )
+
+    with PrefetchingIterator[Floor](pages(), max_pages=2) as results:
+        first = next(results)
+        time.sleep(0.05)
+        assert first.level == 0
+        assert results.buffered_pages <= 2
+        assert len(pages_fetched) <= 4
+        assert [r.level for r in results] == [1, 2, 3, 4]
+
+
+def test_prefetch_raises_errors() -> None:
+    def pages() -> Iterator[Iterator[dict[str, Any]]]:
+        raise RuntimeError("throttled")
+        yield
+
+    with pytest.raises(RuntimeError, match="throttled"):
+        list(PrefetchingIterator[Floor](pages()))
+
+
+def test_write_behind_coalesces(
+    service_client: Any, local_adt_client: ADTClient
+) -> None:
+    floor = Floor(level=1)
+    local_adt_client.upload_twin(floor)
+
+    calls = []
+    upsert = service_client.upsert_digital_twin
+
+    def counting_upsert(*args: Any, **kwargs: Any) -> Any:
+        calls.append(args)
+        return upsert(*args, **kwargs)
+
+    service_client.upsert_digital_twin = counting_upsert
+
+    with local_adt_client.write_behind(max_age=60) as buffer:
+        for level in range(2, 10):
+            buffer.upload_twin(Floor(**{"$dtId": floor.id}, level=level))
+        buffer.update_twin(floor.id, [{"op": "replace", "path": "/level", "value": 42}])
+        buffer.update_twin("other", [{"op": "replace", "path": "/level", "value": 1}])
+        buffer.update_twin("other", [{"op": "replace", "path": "/level", "value": 2}])
+        assert len(buffer) == 2
+        result = buffer.flush()
+
+    assert len(calls) == 1
+    assert service_client.twins[floor.id]["level"] == 42
+    assert result.written == [floor.id]
+    assert list(result.failed) == ["other"]
+
+
+def test_write_behind_keeps_remove_after_add(
+    service_client: Any, local_adt_client: ADTClient
+) -> None:
+    floor = local_adt_client.upload_twin(Floor(level=1))
+
+    with local_adt_client.write_behind(max_age=60) as buffer:
+        buffer.update_twin(floor.id, [{"op": "add", "path": "/note", "value": "a"}])
+        buffer.update_twin(floor.id, [{"op": "remove", "path": "/note"}])
+        buffer.update_twin(floor.id, [{"op": "add", "path": "/label", "value": "a"}])
+        buffer.update_twin(
+            floor.id, [{"op": "replace", "path": "/label", "value": "b"}]
+        )
+        result = buffer.flush()
+
+    assert result.failed == {}
+    assert "note" not in service_client.twins[floor.id]
+    assert service_client.twins[floor.id]["label"] == "b"
+
+
+def test_write_behind_flushes_when_full_or_old(
+    service_client: Any, local_adt_client: ADTClient
+) -> None:
+    buffer = local_adt_client.write_behind(max_pending=3, max_age=0.05)
+    floors = [Floor(level=i) for i in range(4)]
+    for floor in floors[:3]:
+        buffer.upload_twin(floor)
+    assert len(buffer) == 0
+    assert len(service_client.twins) == 3
+
+    buffer.upload_twin(floors[3])
+    time.sleep(0.2)
+    assert len(buffer) == 0
+    assert len(service_client.twins) == 4
+
+
+class Vehicle(BaseModel, model_prefix="duality:sync"):
+    name: str
+
+
+class Truck(Vehicle, model_prefix="duality:sync"):
+    axles: int
+
+
+class Depot(BaseModel, model_prefix="duality:sync"):
+    trucks: Truck = Relationship()  # type: ignore
+
+
+class Garage(BaseModel, model_prefix="duality:sync"):
+    name: str
+
+
+@pytest.fixture()
+def sync_models() -> Iterator[list[Type[BaseModel]]]:
+    """The models to synchronize, whose versions are restored afterwards, since
+    synchronizing pins them to their deployed versions.
+
+    """
+    models: list[Type[BaseModel]] = [Depot, Truck, Vehicle, Garage]
+    yield models
+    for model in models:
+        model.model_version = 1
+
+
+def test_sync_models(
+    service_client: Any,
+    local_adt_client: ADTClient,
+    sync_models: list[Type[BaseModel]],
+) -> None:
+    models = sync_models
+    diff = local_adt_client.sync_models(models)
+    assert set(diff.new) == {m.id for m in models}
+    assert (
+        diff.new.index(Vehicle.id) < diff.new.index(Truck.id) < diff.new.index(Depot.id)
+    )
+
+    diff = local_adt_client.diff_models(models)
+    assert set(diff.unchanged) == {m.id for m in models}
+    assert local_adt_client.sync_models(models).new == []
+
+    # Change the definition of the base model, without changing its version
+    service_client.models[Vehicle.id]["model"]["contents"] = []
+    # Models which extend, or relate to, a changed model are changed with it
+    changed = [
+        "dtmi:duality:sync:vehicle;2",
+        "dtmi:duality:sync:truck;2",
+        "dtmi:duality:sync:depot;2",
+    ]
+    assert local_adt_client.diff_models(models).changed == changed
+
+    old_ids = {m.id for m in models}
+    diff = local_adt_client.sync_models(models)
+    assert diff.changed == changed
+    assert diff.unchanged == [Garage.id]
+    assert diff.ids["dtmi:duality:sync:truck;1"] == Truck.id == diff.changed[1]
+    assert set(diff.stale) == old_ids - {Garage.id}
+    assert all(service_client.models[m]["decommissioned"] for m in diff.stale)
+    assert service_client.models[Truck.id]["model"]["extends"] == Vehicle.id
+    assert BaseModel._class_registry[Vehicle.id] is Vehicle
+    assert BaseModel._class_registry["dtmi:duality:sync:vehicle;1"] is Vehicle
+
+
+def test_sync_models_again(
+    service_client: Any,
+    local_adt_client: ADTClient,
+    sync_models: list[Type[BaseModel]],
+) -> None:
+    models = sync_models
+    local_adt_client.sync_models(models)
+    service_client.models[Vehicle.id]["model"]["contents"] = []
+    local_adt_client.sync_models(models)
+    deployed = dict(service_client.models)
+
+    # A new process starts again from the versions declared in the source
+    for model in models:
+        model.model_version = 1
+    diff = local_adt_client.sync_models(models)
+
+    assert diff.new == diff.changed == diff.stale == []
+    assert set(diff.unchanged) == {
+        "dtmi:duality:sync:vehicle;2",
+        "dtmi:duality:sync:truck;2",
+        "dtmi:duality:sync:depot;2",
+        Garage.id,
+    }
+    assert service_client.models == deployed
+    assert Depot.id == "dtmi:duality:sync:depot;2"
+
+
+def test_sync_models_after_decommission(
+    service_client: Any,
+    local_adt_client: ADTClient,
+    sync_models: list[Type[BaseModel]],
+) -> None:
+    local_adt_client.sync_models([Garage])
+    service_client.decommission_model(Garage.id)
+
+    diff = local_adt_client.sync_models([Garage])
+    assert diff.changed == [Garage.id] == ["dtmi:duality:sync:garage;2"]
+    assert not service_client.models[Garage.id]["decommissioned"]
+
+
+def test_query_stats_and_explain(local_adt_client: ADTClient) -> None:
+    for i in range(25):
+        local_adt_client.upload_twin(Floor(level=i))
+
+    query = local_adt_client.query.of_model(Floor)
+    assert len(list(query.all())) == 25
+    assert query.stats.pages == 3
+    assert query.stats.rows == 25
+    assert query.stats.bytes > 0
+    assert query.stats.charge == 3 + 25
+
+    assert local_adt_client.query.count() == 25
+    assert local_adt_client.query_stats.queries == 2
+    assert local_adt_client.query_stats.charge == 3 + 25 + 2
+
+    query = local_adt_client.query.of_model(Floor)
+    explanation = query.explain(execute=True)
+    assert f"Query:   {query.query_string}" in explanation
+    assert query.query_string.endswith(f"WHERE IS_OF_MODEL('{Floor.id}')")
+    assert "Pages:   3" in explanation
+    assert "Charge:  28" in explanation
+
+
+def test_query_budget(local_adt_client: ADTClient) -> None:
+    for i in range(25):
+        local_adt_client.upload_twin(Floor(level=i))
+
+    results = local_adt_client.query.budget(15).all()
+    with pytest.raises(QueryBudgetExceeded):
+        list(results)
+
+    local_adt_client.query_budget = 5
+    with pytest.raises(QueryBudgetExceeded):
+        list(local_adt_client.query.all())
+
+
+def test_get(local_adt_client: ADTClient) -> None:
+    floor = local_adt_client.upload_twin(Floor(level=1))
+    assert local_adt_client.get(Floor, floor.id) == floor
+    with pytest.raises(TypeError):
+        local_adt_client.get(Site, floor.id)
+    with pytest.raises(ResourceNotFoundError):
+        local_adt_client.get(Floor, "missing")
+
+
+def test_get_many(service_client: Any, local_adt_client: ADTClient) -> None:
+    floors = [local_adt_client.upload_twin(Floor(level=i)) for i in range(150)]
+    site = local_adt_client.upload_twin(Site(name="Site"))
+    ids = [floor.id for floor in floors] + [site.id, "missing"]
+
+    service_client.queries.clear()
+    lookup = local_adt_client.get_many(ids, concurrency=2)
+    assert len(service_client.queries) == 2
+    assert list(lookup.found) == ids[:-1]
+    assert lookup.found[site.id] == site
+    assert lookup.missing == ["missing"]
+
+    lookup = local_adt_client.get_many(ids, model=Floor)
+    assert len(lookup.found) == 150
+    assert lookup.missing == [site.id, "missing"]
+
+
+def test_get_many_cache(service_client: Any, local_adt_client: ADTClient) -> None:
+    local_adt_client.cache = {}
+    floors = [local_adt_client.upload_twin(Floor(level=i)) for i in range(5)]
+    ids = [floor.id for floor in floors]
+    local_adt_client.get_many(ids[:3])
+
+    service_client.queries.clear()
+    lookup = local_adt_client.get_many(ids)
+    assert len(lookup.found) == 5
+    assert service_client.queries == [
+        f"SELECT * FROM digitaltwins WHERE $dtId IN ['{ids[3]}', '{ids[4]}']"
+    ]
+    assert local_adt_client.get(Floor, ids[0]) is lookup.found[ids[0]]
+
+    local_adt_client.update_twin(
+        ids[0], [{"op": "replace", "path": "/level", "value": 9}]
+    )
+    assert local_adt_client.get(Floor, ids[0]).level == 9
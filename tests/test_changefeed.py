@@ -0,0 +1,167 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from duality.changefeed import FileEventSource
+from duality.changefeed import QueueEventSource
+from duality.changefeed import TwinChange
+from duality.changefeed import TwinChangeConsumer
+from duality.changefeed import TwinChangeEvent
+from duality.models import BaseModel
+
+
+class Sensor(BaseModel, model_prefix="duality:changefeed"):
+    name: str
+    reading: float
+
+
+def _cloud_event(type_: str, twin_id: str, data: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "type": f"Microsoft.DigitalTwins.Twin.{type_}",
+        "subject": twin_id,
+        "data": data,
+    }
+
+
+EVENTS = [
+    _cloud_event(
+        "Create",
+        "s1",
+        {"$dtId": "s1", "$metadata": {"$model": Sensor.id}, "name": "a", "reading": 1},
+    ),
+    _cloud_event(
+        "Update",
+        "s1",
+        {
+            "modelId": Sensor.id,
+            "patch": [{"op": "replace", "path": "/reading", "value": 2.5}],
+        },
+    ),
+    _cloud_event(
+        "Update",
+        "unknown",
+        {"modelId": Sensor.id, "patch": [{"op": "replace", "path": "/reading"}]},
+    ),
+    _cloud_event(
+        "Create",
+        "s2",
+        {"$dtId": "s2", "$metadata": {"$model": Sensor.id}, "name": "b", "reading": 3},
+    ),
+    _cloud_event("Delete", "s2", {"$dtId": "s2", "$metadata": {"$model": Sensor.id}}),
+]
+
+
+def test_parse_cloud_event() -> None:
+    event = TwinChangeEvent.parse_event(EVENTS[1])
+    assert event.type == "update"
+    assert event.twin_id == "s1"
+    assert event.model_id == Sensor.id
+    assert event.patch == [{"op": "replace", "path": "/reading", "value": 2.5}]
+
+
+def test_file_source_consumer(tmp_path: Path) -> None:
+    path = tmp_path / "events.jsonl"
+    checkpoint_path = tmp_path / "checkpoint"
+    path.write_text("".join(json.dumps(e) + "\n" for e in EVENTS))
+
+    batches: list[list[TwinChange]] = []
+    consumer = TwinChangeConsumer(
+        FileEventSource(path, checkpoint_path), handlers=[batches.append], batch_size=2
+    )
+    assert len(consumer.poll()) == 2
+    assert consumer.store["s1"] == Sensor(**{"$dtId": "s1"}, name="a", reading=2.5)
+
+    # A new consumer resumes from the checkpoint
+    consumer = TwinChangeConsumer(
+        FileEventSource(path, checkpoint_path),
+        store=consumer.store,
+        batch_size=10,
+        timeout=0.01,
+    )
+    changes = consumer.poll()
+    assert [c.event.twin_id for c in changes] == ["unknown", "s2", "s2"]
+    assert changes[0].twin is None
+    assert isinstance(changes[1].twin, Sensor)
+    assert set(consumer.store) == {"s1"}
+    assert consumer.poll() == []
+    assert len(batches) == 1
+
+
+def test_file_source_waits_for_events(tmp_path: Path) -> None:
+    path = tmp_path / "events.jsonl"
+    path.write_text("")
+    source = FileEventSource(path)
+    source.poll_interval = 0.01
+
+    start = time.monotonic()
+    assert source.read(10, timeout=0.05) == []
+    assert time.monotonic() - start >= 0.05
+
+    def append() -> None:
+        time.sleep(0.05)
+        with open(path, "a") as fp:
+            fp.write(json.dumps(EVENTS[0]) + "\n")
+
+    thread = threading.Thread(target=append)
+    thread.start()
+    assert len(source.read(10, timeout=5)) == 1
+    thread.join()
+
+
+def test_handler_failure_is_not_committed(tmp_path: Path) -> None:
+    path = tmp_path / "events.jsonl"
+    checkpoint_path = tmp_path / "checkpoint"
+    path.write_text(json.dumps(EVENTS[0]) + "\n")
+
+    def fail(_: list[TwinChange]) -> None:
+        raise RuntimeError()
+
+    consumer = TwinChangeConsumer(
+        FileEventSource(path, checkpoint_path), handlers=[fail]
+    )
+    with pytest.raises(RuntimeError):
+        consumer.poll()
+    assert not checkpoint_path.exists()
+    consumer.handlers = []
+    assert len(consumer.poll()) == 1
+    assert checkpoint_path.exists()
+
+
+def test_invalid_events_are_passed_to_on_error(tmp_path: Path) -> None:
+    path = tmp_path / "events.jsonl"
+    bad_create = _cloud_event(
+        "Create", "s2", {"$metadata": {"$model": Sensor.id}, "name": "b"}
+    )
+    bad_update = _cloud_event(
+        "Update", "s1", {"patch": [{"op": "move", "from": "/name", "path": "/x"}]}
+    )
+    events = [bad_create, EVENTS[0], bad_update, EVENTS[1]]
+    path.write_text("".join(json.dumps(e) + "\n" for e in events))
+
+    errors: list[tuple[dict[str, Any], Exception]] = []
+    source = FileEventSource(path)
+    consumer = TwinChangeConsumer(
+        source, on_error=lambda event, e: errors.append((event, e)), timeout=0.01
+    )
+    changes = consumer.poll()
+    assert [event for event, _ in errors] == [bad_create, bad_update]
+    assert [c.event.type for c in changes] == ["create", "update"]
+    assert consumer.store["s1"].reading == 2.5  # type: ignore
+    assert consumer.poll() == []
+
+
+def test_queue_source_consumer() -> None:
+    event_queue: "queue.Queue[dict[str, Any]]" = queue.Queue()
+    for event in EVENTS:
+        event_queue.put(event)
+
+    consumer = TwinChangeConsumer(QueueEventSource(event_queue), timeout=0.01)
+    assert len(consumer.poll()) == len(EVENTS)
+    assert consumer.store["s1"].reading == 2.5  # type: ignore
+    event_queue.join()
+    assert consumer.poll() == []
@@ -0,0 +1,125 @@
+import datetime
+from typing import Any
+from typing import Optional
+
+import pytest
+
+from duality.adt import ADTClient
+from duality.models import BaseModel
+
+pd = pytest.importorskip("pandas")
+
+
+class Reading(BaseModel, model_prefix="duality:frames"):
+    sensor: str
+    value: float
+    count: int
+    valid: bool = True
+    day: datetime.date
+    timestamp: datetime.datetime
+    time_of_day: datetime.time
+    duration: datetime.timedelta
+    note: Optional[str] = None
+
+
+class Timer(BaseModel, model_prefix="duality:frames"):
+    duration: datetime.timedelta
+
+
+COLUMNS: dict[str, list[Any]] = {
+    "$dtId": ["r1", "r2", "r3"],
+    "sensor": ["a", "b", None],
+    "value": [1.5, "2", "x"],
+    "count": [1, 2.0, 2.5],
+    "valid": ["yes", None, "maybe"],
+    "day": ["2021-12-10", datetime.date(2021, 12, 11), "2021-12-12"],
+    "timestamp": ["2021-12-10T12:00:00", "2021-12-10T13:00:00", "2021-12-10T14:00:00"],
+    "time_of_day": ["12:30:00", datetime.time(6, 15), "12:00:00"],
+    "duration": [pd.Timedelta(seconds=5), "1 hour", "1 hour"],
+    "note": ["hello", None, None],
+}
+
+
+def test_from_frame() -> None:
+    frame = Reading.from_frame(pd.DataFrame(COLUMNS))
+
+    assert len(frame) == 2
+    assert frame.errors == {
+        2: [
+            "sensor: field required",
+            "value: not a valid double",
+            "count: not a valid integer",
+            "valid: not a valid boolean",
+        ]
+    }
+    documents = list(frame.to_twin_dtdl())
+    assert documents[0] == {
+        "$dtId": "r1",
+        "$metadata": {"$model": Reading.id},
+        "sensor": "a",
+        "value": 1.5,
+        "count": 1,
+        "valid": True,
+        "day": "2021-12-10",
+        "timestamp": "2021-12-10T12:00:00",
+        "time_of_day": "12:30:00",
+        "duration": "PT5S",
+        "note": "hello",
+    }
+    assert "note" not in documents[1]
+    assert documents[1]["valid"] is True
+    assert documents[1]["time_of_day"] == "06:15:00"
+
+
+def test_from_frame_documents_match_model() -> None:
+    columns = {k: v[:2] for k, v in COLUMNS.items() if k != "$dtId"}
+    columns["timestamp"] = ["2021-12-10T12:00:00.5+01:00", "2021-12-10T12:00:00Z"]
+    frame = Reading.from_frame(columns)
+    documents = list(frame.to_twin_dtdl())
+    assert documents[0]["timestamp"] == "2021-12-10T11:00:00.500000Z"
+    for document in documents:
+        instance = BaseModel.from_twin_dtdl(**document)
+        assert isinstance(instance, Reading)
+        assert instance.id == document["$dtId"]
+        assert instance.duration.total_seconds() in (5, 3600)
+        assert instance.timestamp.tzinfo is not None
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (3600, "PT3600S"),
+        ("90", "PT90S"),
+        (3600.0, "PT3600S"),
+        (datetime.timedelta(microseconds=1), "PT0.000001S"),
+        (datetime.timedelta(hours=-1), "-PT3600S"),
+        ("1 hour", "PT3600S"),
+    ],
+)
+def test_from_frame_durations(value: Any, expected: str) -> None:
+    # Include a fractional duration, such that the column is not formatted as integers
+    frame = Timer.from_frame({"duration": [value, 1.5]})
+    documents = list(frame.to_twin_dtdl())
+    assert [document["duration"] for document in documents] == [expected, "PT1.5S"]
+    assert Timer(**documents[0]).duration == pd.Timedelta(expected)
+
+
+def test_from_frame_integers_out_of_range() -> None:
+    columns = dict(COLUMNS, count=[1e20, 2.0**63, 2**62])
+    frame = Reading.from_frame(columns)
+    assert frame.errors[0] == ["count: not a valid integer"]
+    assert frame.errors[1] == ["count: not a valid integer"]
+    assert "count: not a valid integer" not in frame.errors[2]
+
+
+def test_from_frame_ids() -> None:
+    frame = Timer.from_frame({"id": ["t1", None], "duration": [1, 2]})
+    assert frame.errors == {1: ["id: none is not an allowed value"]}
+    assert [document["$dtId"] for document in frame.to_twin_dtdl()] == ["t1"]
+
+
+def test_upload_frame(service_client: Any, local_adt_client: ADTClient) -> None:
+    frame = Reading.from_frame(COLUMNS)
+    result = local_adt_client.upload_frame(frame)
+    assert sorted(result.written) == ["r1", "r2"]
+    assert set(service_client.twins) == {"r1", "r2"}
@@ -1,4 +1,8 @@
 import datetime
+import json
+import subprocess
+import sys
+from pathlib import Path
 from typing import Type
 
 import pytest
@@ -6,6 +10,9 @@ import pytest
 from duality.dtdl import Interface
 from duality.models import BaseModel
 from duality.models import Relationship
+from duality.models import _ClassRegistry
+from duality.models import load_registry
+from duality.models import save_registry
 
 
 class MyModel(BaseModel, model_prefix="duality", model_version=2):
@@ -119,3 +126,53 @@ def test_related_model_to_dtdl() -> None:
         displayName="MyRelatedModel",
     )
     assert MyRelatedModel.to_dict() == interface.dict()
+
+
+def test_model_id_is_cached_until_changed() -> None:
+    class MyCachedModel(BaseModel, model_prefix="duality:cached"):
+        ...
+
+    assert MyCachedModel.id is MyCachedModel.id
+    MyCachedModel.model_version = 2
+    assert MyCachedModel.id == "dtmi:duality:cached:my_cached_model;2"
+    MyCachedModel.model_version = 1
+
+
+def test_class_registry_resolves_lazily() -> None:
+    registry = _ClassRegistry()
+    registry.add(MyModel)
+    assert not registry._classes
+    assert registry[MyModel.id] is MyModel
+    assert list(registry) == [MyModel.id]
+
+
+def test_save_and_load_registry(tmp_path: Path) -> None:
+    path = tmp_path / "registry.json"
+    save_registry(path)
+
+    registry = _ClassRegistry()
+    BaseModel._class_registry, original = registry, BaseModel._class_registry
+    try:
+        interfaces = load_registry(path)
+        assert isinstance(registry._classes[MyChildModel.id], str)
+        assert registry[MyChildModel.id] is MyChildModel
+    finally:
+        BaseModel._class_registry = original
+    assert interfaces[MyChildModel.id] == MyChildModel.to_interface()
+
+
+def test_save_registry_skips_unresolvable_classes(tmp_path: Path) -> None:
+    class MyLocalModel(BaseModel, model_prefix="duality:local"):
+        ...
+
+    path = tmp_path / "registry.json"
+    save_registry(path)
+    data = json.loads(path.read_text())
+    assert MyLocalModel.id not in data
+    assert all("<locals>" not in entry["class"] for entry in data.values())
+    assert MyChildModel.id in data
+
+
+def test_models_import_does_not_import_azure() -> None:
+    code = "import sys, duality.adt; assert not any(m.startswith('azure') for m in sys.modules)"
+    subprocess.run([sys.executable, "-c", code], check=True)
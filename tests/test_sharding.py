@@ -0,0 +1,113 @@
+from typing import Any
+
+import pytest
+
+from duality.adt import ADTClient
+from duality.models import BaseModel
+from duality.sharding import ShardedADTClient
+from duality.sharding import hash_shard_key
+from duality.sharding import model_prefix_shard_key
+
+
+class Animal(BaseModel, model_prefix="duality:sharding"):
+    name: str
+
+
+class Cow(Animal, model_prefix="duality:sharding:farm"):
+    ...
+
+
+@pytest.fixture()
+def sharded_client(service_clients: list[Any]) -> ShardedADTClient:
+    client = ShardedADTClient([ADTClient(sc) for sc in service_clients])
+    client.sync_models([Animal, Cow])
+    return client
+
+
+def test_models_deployed_to_all_shards(
+    service_clients: list[Any], sharded_client: ShardedADTClient
+) -> None:
+    for service_client in service_clients:
+        assert set(service_client.models) == {Animal.id, Cow.id}
+
+
+def test_models_synced_to_same_version(
+    service_clients: list[Any], sharded_client: ShardedADTClient
+) -> None:
+    # Only the base model on the second shard has drifted from its class
+    service_clients[1].models[Animal.id]["model"]["contents"] = []
+    try:
+        diffs = sharded_client.sync_models([Animal, Cow])
+        assert Animal.id == "dtmi:duality:sharding:animal;2"
+        assert Cow.id == "dtmi:duality:sharding:farm:cow;2"
+        assert all(diff.changed == [Animal.id, Cow.id] for diff in diffs)
+        for service_client in service_clients:
+            for model in (Animal, Cow):
+                assert not service_client.models[model.id]["decommissioned"]
+            assert service_client.models[Cow.id]["model"]["extends"] == Animal.id
+
+        # Synchronizing again is a no-op on every shard
+        diffs = sharded_client.sync_models([Animal, Cow])
+        assert all(diff.new == diff.changed == [] for diff in diffs)
+    finally:
+        Animal.model_version = Cow.model_version = 1
+
+
+def test_twins_routed_by_hash(
+    service_clients: list[Any], sharded_client: ShardedADTClient
+) -> None:
+    animals = [Animal(name=f"Animal {i}") for i in range(60)]
+    for animal in animals:
+        sharded_client.upload_twin(animal)
+
+    for animal in animals:
+        index = hash_shard_key(animal.id, Animal.id, 3)
+        assert animal.id in service_clients[index].twins
+    assert all(service_client.twins for service_client in service_clients)
+
+    sharded_client.delete_twin(animals[0])
+    assert sum(len(service_client.twins) for service_client in service_clients) == 59
+
+
+def test_queries_fan_out(sharded_client: ShardedADTClient) -> None:
+    twins = [Animal(name=f"Animal {i}") for i in range(40)]
+    twins += [Cow(name=f"Cow {i}") for i in range(20)]
+    for twin in twins:
+        sharded_client.upload_twin(twin)
+
+    assert sharded_client.query.count() == 60
+    assert sharded_client.query.of_model(Cow).count() == 20
+    query = sharded_client.query.of_model(Animal)
+    assert {twin.id for twin in query.all()} == {twin.id for twin in twins}
+    assert query.stats.rows == 60
+    assert sharded_client.query_stats.queries == 2 * 3 + 3
+
+
+def test_twins_routed_by_model_prefix(service_clients: list[Any]) -> None:
+    shard_key = model_prefix_shard_key({"dtmi:duality:sharding:farm": 2})
+    sharded_client = ShardedADTClient(
+        [ADTClient(sc) for sc in service_clients], shard_key=shard_key
+    )
+    cows = [Cow(name=f"Cow {i}") for i in range(10)]
+    for cow in cows:
+        sharded_client.upload_twin(cow)
+    assert len(service_clients[2].twins) == 10
+
+    # Without a model, the shard of each twin is unknown, so all shards are queried
+    lookup = sharded_client.get_many([cow.id for cow in cows])
+    assert list(lookup.found) == [cow.id for cow in cows]
+    assert all(len(service_client.queries) == 1 for service_client in service_clients)
+
+
+def test_lookups_routed(
+    service_clients: list[Any], sharded_client: ShardedADTClient
+) -> None:
+    animals = [Animal(name=f"Animal {i}") for i in range(30)]
+    for animal in animals:
+        sharded_client.upload_twin(animal)
+
+    assert sharded_client.get(Animal, animals[0].id) == animals[0]
+    lookup = sharded_client.get_many([a.id for a in animals] + ["missing"])
+    assert list(lookup.found) == [a.id for a in animals]
+    assert lookup.missing == ["missing"]
+    assert all(len(service_client.queries) == 1 for service_client in service_clients)
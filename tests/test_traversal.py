@@ -0,0 +1,97 @@
+from typing import Any
+
+import pytest
+
+from duality.adt import ADTClient
+from duality.models import BaseModel
+from duality.models import Relationship
+from duality.traversal import traverse
+
+
+class Equipment(BaseModel, model_prefix="duality:traversal"):
+    name: str
+
+
+class Room(BaseModel, model_prefix="duality:traversal"):
+    name: str
+    equipment: Equipment = Relationship()  # type: ignore
+    adjacent_to: "Room" = Relationship()  # type: ignore
+
+
+Room.update_forward_refs()
+
+
+class Storey(BaseModel, model_prefix="duality:traversal"):
+    level: int
+    rooms: Room = Relationship()  # type: ignore
+
+
+class Tower(BaseModel, model_prefix="duality:traversal"):
+    name: str
+    storeys: Storey = Relationship()  # type: ignore
+
+
+def _relate(
+    service_client: Any, source: BaseModel, name: str, target: BaseModel
+) -> None:
+    service_client.upsert_relationship(
+        source.id,
+        f"{source.id}-{name}-{target.id}",
+        {"$targetId": target.id, "$relationshipName": name},
+    )
+
+
+@pytest.fixture()
+def tower(service_client: Any, local_adt_client: ADTClient) -> Tower:
+    """A tower with 3 storeys, each with 40 rooms, each with a piece of equipment.
+
+    Adjacent rooms on each storey are related in a cycle, and all rooms of a storey share
+    a single piece of equipment.
+
+    """
+    tower = Tower(name="Tower")
+    local_adt_client.upload_twin(tower)
+    for level in range(3):
+        storey = Storey(level=level)
+        equipment = Equipment(name=f"Equipment {level}")
+        local_adt_client.upload_twin(storey)
+        local_adt_client.upload_twin(equipment)
+        _relate(service_client, tower, "storeys", storey)
+        rooms = [Room(name=f"Room {level}.{i}") for i in range(40)]
+        for i, room in enumerate(rooms):
+            local_adt_client.upload_twin(room)
+            _relate(service_client, storey, "rooms", room)
+            _relate(service_client, room, "equipment", equipment)
+            _relate(service_client, room, "adjacent_to", rooms[i - 1])
+    return tower
+
+
+def test_relationships() -> None:
+    assert Room.relationships() == {"equipment": Equipment, "adjacent_to": Room}
+    assert "rooms" not in Storey(level=1).to_twin_dtdl()
+
+
+def test_traverse(
+    service_client: Any, local_adt_client: ADTClient, tower: Tower
+) -> None:
+    service_client.queries.clear()
+    nodes = list(traverse(local_adt_client, [tower]))
+
+    assert len(nodes) == 1 + 3 + 120 + 3
+    assert len({node.twin.id for node in nodes}) == len(nodes)
+    assert [node.depth for node in nodes] == sorted(node.depth for node in nodes)
+    assert {type(node.twin) for node in nodes if node.depth == 3} == {Equipment}
+    storey = nodes[1]
+    assert (storey.source_id, storey.relationship_name) == (tower.id, "storeys")
+    # A relationship and twin query per level, with the 120 rooms needing 2 chunks each
+    assert len(service_client.queries) == 2 + 3 + 3
+
+
+def test_traverse_max_depth_and_models(
+    local_adt_client: ADTClient, tower: Tower
+) -> None:
+    nodes = list(traverse(local_adt_client, [tower], max_depth=1))
+    assert [node.twin.model_id for node in nodes] == [Tower.id] + [Storey.id] * 3
+
+    nodes = list(traverse(local_adt_client, [tower], models=[Storey, Equipment]))
+    assert [node.twin.model_id for node in nodes] == [Tower.id] + [Storey.id] * 3